@@ -0,0 +1,378 @@
+"""
+Content-addressed local cache for TLC trip files, shared by every fetcher in the repo.
+
+Files are stored under <cache>/objects/<sha256[:2]>/<sha256>/<file name>, so
+callers still see the original file name. index.json maps each URL to its
+blob, the server's size / ETag, and when it was last used. A cached copy is
+reused when its size and ETag still match a HEAD request (or when the server
+cannot be reached). The least recently used entries are evicted once the
+cache grows past its byte budget.
+
+Large files are fetched as byte ranges over several keep-alive connections
+and written into a preallocated .part file. A sidecar .part.json records the
+finished ranges, so an interrupted download resumes where it stopped. Servers
+without range support get a single streamed download.
+
+Settings come from the environment:
+    TLC_CACHE_DIR         cache location (default ~/.cache/tlc)
+    TLC_CACHE_MAX_BYTES   byte budget (default 20 GiB)
+    TLC_DOWNLOAD_WORKERS  connections per ranged download (default 4, 1 = single stream)
+"""
+import fcntl
+import hashlib
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+CACHE_DIR = os.environ.get("TLC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tlc"))
+CACHE_MAX_BYTES = int(os.environ.get("TLC_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+
+DOWNLOAD_WORKERS = int(os.environ.get("TLC_DOWNLOAD_WORKERS", 4))
+
+READ_SIZE = 1024 * 1024
+RANGE_SIZE = 16 * 1024 * 1024
+RANGE_RETRIES = 3
+TIMEOUT = 60
+
+_index_lock = threading.Lock()
+
+
+def _index_path(cache_dir):
+    return os.path.join(cache_dir, "index.json")
+
+
+@contextmanager
+def _locked_index(cache_dir):
+    """Read-modify-write index.json under a thread lock and a file lock."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with _index_lock, open(os.path.join(cache_dir, "index.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            with open(_index_path(cache_dir)) as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+
+        yield index
+
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, _index_path(cache_dir))
+
+
+def _blob_path(cache_dir, sha256, file_name):
+    return os.path.join(cache_dir, "objects", sha256[:2], sha256, file_name)
+
+
+def head(url):
+    """Return (size, etag, accepts ranges, final url after redirects), or None if the server cannot be reached."""
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=TIMEOUT) as response:
+            size = response.headers.get("Content-Length")
+            ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return (int(size) if size else None), response.headers.get("ETag"), ranges, response.geturl()
+    except (urllib.error.URLError, TimeoutError):
+        return None
+
+
+class RangesNotSupported(Exception):
+    """The server answered a range request with something other than 206."""
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _download_stream(url, part_path):
+    """Single streamed GET into part_path; returns (size, etag)."""
+    size = 0
+    with urllib.request.urlopen(url, timeout=TIMEOUT) as response, open(part_path, "wb") as f:
+        expected_size = response.headers.get("Content-Length")
+        etag = response.headers.get("ETag")
+        while True:
+            block = response.read(READ_SIZE)
+            if not block:
+                break
+            f.write(block)
+            size += len(block)
+
+    if expected_size is not None and size != int(expected_size):
+        raise IOError(f"Incomplete download of {url}: {size} of {expected_size} bytes")
+    return size, etag
+
+
+def _load_state(state_path, expected):
+    """Finished range indexes from the sidecar file, if it belongs to the same remote file."""
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if any(state.get(key) != value for key, value in expected.items()):
+        return None
+    return set(state["done"])
+
+
+def _save_state(state_path, expected, done):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(state_path), suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump({**expected, "done": sorted(done)}, f)
+    os.replace(tmp_path, state_path)
+
+
+def _download_ranges(url, part_path, size, etag, workers, source_url=None):
+    """Fetch url as RANGE_SIZE byte ranges over `workers` keep-alive connections into part_path.
+
+    Finished ranges are recorded in part_path + ".json"; a later call with
+    the same url, size and ETag only fetches the missing ones. source_url is
+    the URL to fetch from when url redirects (signed URLs change per request).
+    """
+    state_path = part_path + ".json"
+    expected = {"url": url, "size": size, "etag": etag, "range_size": RANGE_SIZE}
+    source_url = source_url or url
+    ranges = [(start, min(start + RANGE_SIZE, size) - 1) for start in range(0, size, RANGE_SIZE)]
+
+    done = _load_state(state_path, expected)
+    if done is None or not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+        done = set()
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+        _save_state(state_path, expected, done)
+    elif done:
+        print(f"Resuming {os.path.basename(part_path)}: {len(done)} of {len(ranges)} ranges already downloaded")
+
+    parts = urllib.parse.urlsplit(source_url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    local = threading.local()
+    connections = []
+    state_lock = threading.Lock()
+    # Set when a range fails, so the ranges still downloading stop early
+    stop = threading.Event()
+
+    def fetch_range(index):
+        start, end = ranges[index]
+        headers = {"Range": f"bytes={start}-{end}"}
+        if etag:
+            # The server sends the whole (new) file instead of a 206 if it changed
+            headers["If-Range"] = etag
+
+        for attempt in range(RANGE_RETRIES):
+            if getattr(local, "connection", None) is None:
+                local.connection = connection_class(parts.hostname, parts.port, timeout=TIMEOUT)
+                with state_lock:
+                    connections.append(local.connection)
+            try:
+                local.connection.request("GET", path, headers=headers)
+                response = local.connection.getresponse()
+                if response.status != 206:
+                    response.close()
+                    raise RangesNotSupported(f"{url} answered a range request with {response.status}")
+                offset = start
+                while True:
+                    if stop.is_set():
+                        # Not recorded as done, so the next attempt fetches it again
+                        return
+                    block = response.read(READ_SIZE)
+                    if not block:
+                        break
+                    os.pwrite(fd, block, offset)
+                    offset += len(block)
+                if offset != end + 1:
+                    raise IOError(f"Short range {start}-{end} of {url}: got {offset - start} bytes")
+                break
+            except (http.client.HTTPException, OSError):
+                # Keep-alive connections may have been dropped by the server
+                local.connection.close()
+                local.connection = None
+                if attempt == RANGE_RETRIES - 1:
+                    raise
+
+        with state_lock:
+            done.add(index)
+            _save_state(state_path, expected, done)
+
+    missing = [index for index in range(len(ranges)) if index not in done]
+    fd = os.open(part_path, os.O_WRONLY)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for future in [executor.submit(fetch_range, index) for index in missing]:
+            future.result()
+    except BaseException:
+        # A failed range or Ctrl-C: drop the queued ranges instead of waiting for all of them
+        stop.set()
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        os.close(fd)
+        for connection in connections:
+            connection.close()
+
+    os.remove(state_path)
+
+
+def _part_path(cache_dir, url):
+    # A stable name per URL, so an interrupted ranged download can be resumed
+    tmp_dir = os.path.join(cache_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, hashlib.sha1(url.encode()).hexdigest() + ".part")
+
+
+@contextmanager
+def _url_lock(cache_dir, url):
+    """One process at a time per URL, held until its index entry is written; yields the .part path."""
+    part_path = _part_path(cache_dir, url)
+    with open(part_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield part_path
+
+
+def _placed_meanwhile(cache_dir, url, seen):
+    """The index entry for url if another process replaced seen (the stale or missing entry) and its blob is complete."""
+    with _locked_index(cache_dir) as index:
+        current = index.get(url)
+    if current is None:
+        return None
+    if seen is not None and (current["sha256"], current["etag"]) == (seen["sha256"], seen["etag"]):
+        return None
+    blob_path = _blob_path(cache_dir, current["sha256"], current["file_name"])
+    if not (os.path.exists(blob_path) and os.path.getsize(blob_path) == current["size"]):
+        return None
+    return current
+
+
+def _download(url, cache_dir, file_name, part_path, workers=None):
+    """Download url into the cache (ranged when possible), then hash it; returns the new index entry.
+
+    The caller holds _url_lock for url.
+    """
+    workers = DOWNLOAD_WORKERS if workers is None else workers
+    remote = head(url)
+    size, etag, ranges, final_url = remote if remote is not None else (None, None, False, url)
+    try:
+        if workers > 1 and ranges and size is not None and size >= 2 * RANGE_SIZE:
+            try:
+                _download_ranges(url, part_path, size, etag, workers, source_url=final_url)
+            except RangesNotSupported as e:
+                print(f"{e}, falling back to a single stream")
+                os.remove(part_path + ".json")
+                size, etag = _download_stream(url, part_path)
+        else:
+            size, etag = _download_stream(url, part_path)
+    except BaseException:
+        # Ranged downloads keep their .part and state for the next attempt
+        if not os.path.exists(part_path + ".json") and os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    sha256 = _sha256_file(part_path)
+    blob_path = _blob_path(cache_dir, sha256, file_name)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(part_path, blob_path)
+
+    return {"sha256": sha256, "file_name": file_name, "size": size, "etag": etag}
+
+
+def _remove_blob(index, cache_dir, entry):
+    """Delete an entry's blob unless another URL in the index still points at it."""
+    if any(other["sha256"] == entry["sha256"] and other["file_name"] == entry["file_name"]
+           for other in index.values()):
+        return
+    blob_dir = os.path.dirname(_blob_path(cache_dir, entry["sha256"], entry["file_name"]))
+    shutil.rmtree(blob_dir, ignore_errors=True)
+
+
+def _evict(index, cache_dir, max_bytes, keep):
+    """Drop least recently used entries until the cache fits in max_bytes."""
+    total = sum(entry["size"] for entry in index.values())
+    for url, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+        if total <= max_bytes:
+            break
+        if url == keep:
+            continue
+        del index[url]
+        _remove_blob(index, cache_dir, entry)
+        total -= entry["size"]
+        print(f"Evicted {entry['file_name']} from download cache ({entry['size']:,} bytes)")
+
+
+def _place(blob_path, dest_dir):
+    """Expose a cached blob in dest_dir under its file name (hard link, else copy)."""
+    if dest_dir is None:
+        return blob_path
+
+    os.makedirs(dest_dir, exist_ok=True)
+    dest_path = os.path.join(dest_dir, os.path.basename(blob_path))
+    if os.path.exists(dest_path):
+        if os.path.samefile(dest_path, blob_path):
+            return dest_path
+        os.remove(dest_path)
+    try:
+        os.link(blob_path, dest_path)
+    except OSError:
+        shutil.copyfile(blob_path, dest_path)
+    return dest_path
+
+
+def fetch(url, cache_dir=None, max_bytes=None, revalidate=True, dest_dir=None):
+    """Return a local path for url, downloading only when the cached copy is missing or stale.
+
+    With dest_dir the file is also placed there under its original name and
+    that path is returned instead of the path inside the cache.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    file_name = os.path.basename(url.split("?", 1)[0])
+
+    with _locked_index(cache_dir) as index:
+        entry = index.get(url)
+
+    if entry is not None:
+        blob_path = _blob_path(cache_dir, entry["sha256"], entry["file_name"])
+        fresh = os.path.exists(blob_path) and os.path.getsize(blob_path) == entry["size"]
+        if fresh and revalidate:
+            remote = head(url)
+            if remote is not None:
+                size, etag = remote[:2]
+                fresh = (size is None or size == entry["size"]) and (etag is None or etag == entry["etag"])
+        if fresh:
+            with _locked_index(cache_dir) as index:
+                if url in index:
+                    index[url]["last_used"] = time.time()
+            print(f"Cache hit: {file_name}")
+            return _place(blob_path, dest_dir)
+
+    # A second process fetching the same URL waits here, then reuses what the first one placed
+    with _url_lock(cache_dir, url) as part_path:
+        placed = _placed_meanwhile(cache_dir, url, seen=entry)
+        if placed is not None:
+            print(f"Downloaded by another process meanwhile: {file_name}")
+            return _place(_blob_path(cache_dir, placed["sha256"], placed["file_name"]), dest_dir)
+
+        print(f"Downloading {url}...")
+        entry = _download(url, cache_dir, file_name, part_path)
+        entry["last_used"] = time.time()
+
+        with _locked_index(cache_dir) as index:
+            stale = index.get(url)
+            index[url] = entry
+            if stale is not None and stale["sha256"] != entry["sha256"]:
+                _remove_blob(index, cache_dir, stale)
+            _evict(index, cache_dir, max_bytes, keep=url)
+
+    return _place(_blob_path(cache_dir, entry["sha256"], entry["file_name"]), dest_dir)
@@ -0,0 +1,67 @@
+"""
+In-memory index of the objects under a GCS prefix, built from one listing.
+
+Checking files one by one with blob.exists() costs one round trip per file.
+BlobIndex lists the prefix once (a single list_blobs call per 1000 objects)
+and answers existence, size and checksum questions from memory. Uploads made
+through the same process are added to the index as they finish.
+
+blob_index() keeps one index per bucket and prefix for the whole process,
+so every caller shares the same listing.
+"""
+import threading
+
+# Only what the existence / checksum checks need
+LIST_FIELDS = "items(name,size,crc32c,md5Hash,generation,updated,metadata),nextPageToken"
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+class BlobIndex:
+    """Blob name -> Blob (with size, crc32c, md5_hash) for every object under a prefix."""
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket = bucket
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._blobs = {}
+        self.refresh()
+
+    def refresh(self):
+        """Re-list the prefix."""
+        blobs = {blob.name: blob for blob in self.bucket.list_blobs(prefix=self.prefix, fields=LIST_FIELDS)}
+        with self._lock:
+            self._blobs = blobs
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._blobs
+
+    def __len__(self):
+        with self._lock:
+            return len(self._blobs)
+
+    def get(self, name):
+        """The listed (or since uploaded) Blob, or None."""
+        with self._lock:
+            return self._blobs.get(name)
+
+    def add(self, blob):
+        """Record a blob whose properties came back from an upload."""
+        with self._lock:
+            self._blobs[blob.name] = blob
+
+    def remove(self, name):
+        with self._lock:
+            self._blobs.pop(name, None)
+
+
+def blob_index(bucket, prefix=""):
+    """The process-wide BlobIndex for bucket/prefix, listed on first use."""
+    key = (bucket.name, prefix)
+    with _lock:
+        if key not in _indexes:
+            _indexes[key] = BlobIndex(bucket, prefix)
+        return _indexes[key]
+
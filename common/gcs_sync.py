@@ -0,0 +1,195 @@
+"""
+Skip-unchanged uploads to GCS.
+
+A local file is uploaded only when the object under its name is missing or
+has a different size or checksum. The comparison uses CRC32C, which GCS
+keeps for every object, composite ones included, and falls back to MD5. The
+remote side comes from a BlobIndex listing (common/gcs_index.py), so
+unchanged files cost no API calls at all.
+
+Files of COMPOSITE_THRESHOLD bytes and up are uploaded as parallel
+composite slices: up to MAX_SLICES temporary objects are sent side by side,
+joined with compose(), and then deleted. The composed object's CRC32C is
+checked against the local file.
+"""
+import base64
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+
+from common.gcs_index import blob_index
+
+COMPOSITE_THRESHOLD = 150 * 1024 * 1024
+SLICE_MIN_BYTES = 32 * 1024 * 1024
+MAX_SLICES = 32  # compose() accepts at most 32 sources
+SLICE_WORKERS = 8
+
+READ_SIZE = 1024 * 1024
+
+
+class SyncStats:
+    """Files and bytes skipped vs transferred; shared by upload threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self.transferred_files = 0
+        self.transferred_bytes = 0
+
+    def skipped(self, size):
+        with self._lock:
+            self.skipped_files += 1
+            self.skipped_bytes += size
+
+    def transferred(self, size):
+        with self._lock:
+            self.transferred_files += 1
+            self.transferred_bytes += size
+
+    def summary(self):
+        total = self.skipped_bytes + self.transferred_bytes
+        print(f"\nSync summary: {self.transferred_files} files uploaded ({self.transferred_bytes / 1024 ** 2:,.1f} MB), "
+              f"{self.skipped_files} unchanged files skipped ({self.skipped_bytes / 1024 ** 2:,.1f} MB)")
+        if total:
+            print(f"  {self.skipped_bytes / total:.0%} of {total / 1024 ** 2:,.1f} MB did not need to be sent")
+
+
+def local_checksums(path):
+    """(size, crc32c, md5) of a local file, base64-encoded like GCS object metadata."""
+    crc = google_crc32c.Checksum()
+    md5 = hashlib.md5()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            crc.update(block)
+            md5.update(block)
+            size += len(block)
+    return size, base64.b64encode(crc.digest()).decode(), base64.b64encode(md5.digest()).decode()
+
+
+def is_unchanged(blob, checksums):
+    """True when an existing blob has the same size and CRC32C (or MD5) as the local file."""
+    if blob is None:
+        return False
+    size, crc32c, md5 = checksums
+    if blob.size != size:
+        return False
+    if blob.crc32c:
+        return blob.crc32c == crc32c
+    return blob.md5_hash == md5
+
+
+class FileSlice(io.RawIOBase):
+    """Bytes [start, start + length) of an open file, seen as a stream of its own starting at 0.
+
+    Resumable uploads insist on a stream positioned at 0 and seek within it
+    to retry a chunk, so a slice cannot be sent from a shared file offset.
+    """
+
+    def __init__(self, f, start, length):
+        self.f = f
+        self.start = start
+        self.length = length
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.position = min(max(offset, 0), self.length)
+        return self.position
+
+    def read(self, size=-1):
+        remaining = self.length - self.position
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        self.f.seek(self.start + self.position)
+        data = self.f.read(size)
+        self.position += len(data)
+        return data
+
+
+def _upload_slice(bucket, path, slice_name, start, length):
+    slice_blob = bucket.blob(slice_name)
+    # Resumable, so only one chunk of the slice is held in memory
+    slice_blob.chunk_size = 8 * 1024 * 1024
+    with open(path, "rb") as f:
+        slice_blob.upload_from_file(FileSlice(f, start, length), size=length)
+    return slice_blob
+
+
+def upload_composite(bucket, path, blob_name, size, crc32c):
+    """Upload path as parallel slices and compose them into blob_name."""
+    slice_size = max(SLICE_MIN_BYTES, -(-size // MAX_SLICES))
+    offsets = list(range(0, size, slice_size))
+    print(f"  Uploading {os.path.basename(path)} as {len(offsets)} composite slices")
+
+    slices = []
+    try:
+        with ThreadPoolExecutor(max_workers=SLICE_WORKERS) as executor:
+            futures = [
+                executor.submit(_upload_slice, bucket, path, f"{blob_name}.slice-{i:02d}", start, min(slice_size, size - start))
+                for i, start in enumerate(offsets)
+            ]
+        # Every slice has finished here; keep the uploaded ones so they are cleaned up
+        slices = [future.result() for future in futures if future.exception() is None]
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+        blob = bucket.blob(blob_name)
+        blob.compose(slices)
+    finally:
+        for slice_blob in slices:
+            slice_blob.delete()
+
+    if blob.crc32c != crc32c:
+        raise IOError(f"CRC32C mismatch after composing gs://{bucket.name}/{blob_name}")
+    return blob
+
+
+def sync_file(bucket, path, blob_name, stats=None, index_prefix=None):
+    """Upload path to blob_name unless the object is already identical; returns the blob in the bucket.
+
+    The remote state comes from the shared listing of index_prefix (default:
+    the blob's folder).
+    """
+    if index_prefix is None:
+        folder = os.path.dirname(blob_name)
+        index_prefix = f"{folder}/" if folder else ""
+    index = blob_index(bucket, index_prefix)
+    checksums = local_checksums(path)
+    size, crc32c, _ = checksums
+
+    existing = index.get(blob_name)
+    if is_unchanged(existing, checksums):
+        print(f"  Unchanged, skipping: gs://{bucket.name}/{blob_name}")
+        if stats is not None:
+            stats.skipped(size)
+        return existing
+
+    if size >= COMPOSITE_THRESHOLD:
+        blob = upload_composite(bucket, path, blob_name, size, crc32c)
+    else:
+        blob = bucket.blob(blob_name)
+        blob.upload_from_filename(path)
+    index.add(blob)
+    print(f"  Uploaded: gs://{bucket.name}/{blob_name} ({size / 1024 ** 2:,.1f} MB)")
+    if stats is not None:
+        stats.transferred(size)
+    return blob
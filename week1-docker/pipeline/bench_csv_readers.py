@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Compare parse throughput and memory of the pandas and arrow CSV readers."""
+
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import numpy as np
+import pandas as pd
+
+from ingest_data import READERS, read_csv_chunks
+from ingest_parquet import peak_rss_mb
+
+
+def generate_yellow_csv(file_path: str, rows: int, seed: int = 42, block: int = 1_000_000):
+    """Write a synthetic yellow trip .csv.gz with the real column layout."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2021-01-01")
+
+    for offset in range(0, rows, block):
+        n = min(block, rows - offset)
+        pickup = start + pd.to_timedelta(rng.integers(0, 31 * 86400, n), unit="s")
+        passenger_count = pd.array(rng.integers(0, 6, n), dtype="Int64")
+        passenger_count[rng.random(n) < 0.02] = pd.NA
+
+        df = pd.DataFrame({
+            "VendorID": rng.integers(1, 3, n),
+            "tpep_pickup_datetime": pickup,
+            "tpep_dropoff_datetime": pickup + pd.to_timedelta(rng.integers(60, 3600, n), unit="s"),
+            "passenger_count": passenger_count,
+            "trip_distance": rng.gamma(2.0, 1.5, n).round(2),
+            "RatecodeID": rng.integers(1, 6, n),
+            "store_and_fwd_flag": rng.choice(["N", "Y"], n, p=[0.99, 0.01]),
+            "PULocationID": rng.integers(1, 266, n),
+            "DOLocationID": rng.integers(1, 266, n),
+            "payment_type": rng.integers(1, 5, n),
+            "fare_amount": rng.gamma(2.0, 6.0, n).round(2),
+            "extra": rng.choice([0.0, 0.5, 1.0], n),
+            "mta_tax": 0.5,
+            "tip_amount": rng.gamma(1.0, 2.0, n).round(2),
+            "tolls_amount": 0.0,
+            "improvement_surcharge": 0.3,
+            "total_amount": rng.gamma(2.0, 8.0, n).round(2),
+            "congestion_surcharge": rng.choice([0.0, 2.5], n),
+        })
+        # each block is appended as its own gzip member; gzip readers concatenate them
+        df.to_csv(
+            file_path,
+            mode="w" if offset == 0 else "a",
+            header=offset == 0,
+            index=False,
+            compression={"method": "gzip", "compresslevel": 1},
+        )
+
+
+def parse_file(file_path: str, reader: str, chunksize: int):
+    """Parse every chunk with one backend; runs in a fresh process for clean RSS."""
+    t0 = time.perf_counter()
+    rows = 0
+    for df_chunk in read_csv_chunks(file_path, chunksize, reader):
+        rows += len(df_chunk)
+    return rows, time.perf_counter() - t0, peak_rss_mb()
+
+
+@click.command()
+@click.option('--rows', default=5_000_000, type=int, help='Rows in the generated file')
+@click.option('--file', 'file_path', default=None, help='Existing .csv.gz to parse instead of generating one')
+@click.option('--chunksize', default=100000, type=int, help='Chunk size for parsing')
+def main(rows, file_path, chunksize):
+    # Linux keeps ru_maxrss across fork/exec, so the parent stays small and
+    # both generating and parsing happen in spawned child processes
+    spawn = multiprocessing.get_context("spawn")
+
+    tmp_dir = None
+    if file_path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        file_path = os.path.join(tmp_dir.name, "yellow_bench.csv.gz")
+        print(f"Generating {rows:,} rows into {file_path}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            executor.submit(generate_yellow_csv, file_path, rows).result()
+
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    print(f"File size: {size_mb:.1f} MB (compressed)")
+
+    results = []
+    for reader in READERS:
+        # a fresh process per backend so peak RSS is not shared between them
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            results.append((reader, *executor.submit(parse_file, file_path, reader, chunksize).result()))
+
+    print(f"\n{'reader':<8} {'rows':>12} {'seconds':>9} {'rows/s':>12} {'MB/s':>8} {'peak RSS MB':>12}")
+    for reader, parsed_rows, elapsed, peak_mb in results:
+        print(f"{reader:<8} {parsed_rows:>12,} {elapsed:>9.2f} {parsed_rows / elapsed:>12,.0f} "
+              f"{size_mb / elapsed:>8.1f} {peak_mb:>12.1f}")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
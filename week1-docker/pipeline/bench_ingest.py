@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Compare rows/s of the to_sql and COPY loaders on the same CSV file."""
+
+import time
+
+import click
+from sqlalchemy import create_engine, text
+
+from ingest_data import LOADERS, ingest_data
+
+
+def bench_loader(file_path, engine, loader, chunksize):
+    """Ingest the file with one loader and return (rows, seconds)."""
+    target_table = f"bench_{loader.replace('-', '_')}"
+
+    t0 = time.perf_counter()
+    ingest_data(
+        url=file_path,
+        engine=engine,
+        target_table=target_table,
+        chunksize=chunksize,
+        loader=loader,
+        resume=False
+    )
+    elapsed = time.perf_counter() - t0
+
+    with engine.connect() as conn:
+        rows = conn.execute(text(f'SELECT count(*) FROM "{target_table}"')).scalar()
+        conn.execute(text(f'DROP TABLE IF EXISTS "{target_table}"'))
+        conn.commit()
+
+    return rows, elapsed
+
+
+@click.command()
+@click.option('--pg-user', default='root', help='PostgreSQL username')
+@click.option('--pg-pass', default='root', help='PostgreSQL password')
+@click.option('--pg-host', default='localhost', help='PostgreSQL host')
+@click.option('--pg-port', default='5432', help='PostgreSQL port')
+@click.option('--pg-db', default='ny_taxi', help='PostgreSQL database name')
+@click.option('--file', 'file_path', required=True, help='Local path or URL of a yellow .csv.gz file')
+@click.option('--chunksize', default=100000, type=int, help='Chunk size for ingestion')
+@click.option('--loader', 'loaders', multiple=True, type=click.Choice(LOADERS), help='Loaders to compare (default: all)')
+def main(pg_user, pg_pass, pg_host, pg_port, pg_db, file_path, chunksize, loaders):
+    engine = create_engine(f'postgresql+psycopg://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
+
+    results = []
+    for loader in loaders or LOADERS:
+        rows, elapsed = bench_loader(file_path, engine, loader, chunksize)
+        results.append((loader, rows, elapsed))
+
+    baseline = dict((loader, rows / elapsed) for loader, rows, elapsed in results).get("to_sql")
+
+    print(f"\n{'loader':<12} {'rows':>12} {'seconds':>10} {'rows/s':>12} {'speedup':>8}")
+    for loader, rows, elapsed in results:
+        rate = rows / elapsed
+        speedup = f"{rate / baseline:.1f}x" if baseline else "-"
+        print(f"{loader:<12} {rows:>12,} {elapsed:>10.2f} {rate:>12,.0f} {speedup:>8}")
+
+
+if __name__ == '__main__':
+    main()
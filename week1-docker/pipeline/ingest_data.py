@@ -1,77 +1,333 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import io
+import itertools
+import queue
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from sqlalchemy import create_engine
 from tqdm.auto import tqdm
 import click
 
-dtype = {
-    "VendorID": "Int64",
-    "passenger_count": "Int64",
-    "trip_distance": "float64",
-    "RatecodeID": "Int64",
-    "store_and_fwd_flag": "string",
-    "PULocationID": "Int64",
-    "DOLocationID": "Int64",
-    "payment_type": "Int64",
-    "fare_amount": "float64",
-    "extra": "float64",
-    "mta_tax": "float64",
-    "tip_amount": "float64",
-    "tolls_amount": "float64",
-    "improvement_surcharge": "float64",
-    "total_amount": "float64",
-    "congestion_surcharge": "float64"
-}
-
-parse_dates = [
-    "tpep_pickup_datetime",
-    "tpep_dropoff_datetime"
-]
+import schemas
+from ingest_metrics import CountingReader, IngestMetrics
+from load_manifest import SourceChanged, loaded_chunks, pending_chunks, record_chunk, reset_manifest
+from post_load import post_load
 
+# CSV columns and their compact types come from the schema registry (--dataset)
+LOADERS = ["to_sql", "copy-text", "copy-binary"]
+READERS = ["pandas", "arrow"]
 
-def ingest_data(
-        url: str,
-        engine,
-        target_table: str,
-        chunksize: int = 100000,
-) -> pd.DataFrame:
-    df_iter = pd.read_csv(
-        url,
-        dtype=dtype,
-        parse_dates=parse_dates,
-        iterator=True,
-        chunksize=chunksize
-    )
 
-    first_chunk = next(df_iter)
+def column_pg_type(column: str, dataset: str = "yellow") -> str:
+    """Map a column to its PostgreSQL type using the schema registry."""
+    return schemas.pg_type(dataset, column)
 
-    first_chunk.head(0).to_sql(
-        name=target_table,
-        con=engine,
-        if_exists="replace"
-    )
 
-    print(f"Table {target_table} created")
+def open_raw(url: str):
+    """Open a local path or URL as a binary stream, still compressed."""
+    if url.startswith(("http://", "https://")):
+        return urllib.request.urlopen(url)
+    return open(url, "rb", buffering=0)
 
-    first_chunk.to_sql(
-        name=target_table,
-        con=engine,
-        if_exists="append"
+
+def open_source(url: str, raw=None):
+    """Open a local path or URL (or an already opened raw stream) as an arrow input stream, decompressing .gz."""
+    compression = "gzip" if url.endswith(".gz") else None
+    if raw is not None:
+        return pa.input_stream(raw, compression=compression)
+    if url.startswith(("http://", "https://")):
+        return pa.input_stream(urllib.request.urlopen(url), compression=compression)
+    return pa.input_stream(url, compression=compression)
+
+
+def read_csv_arrow(url: str, chunksize: int = 100000, block_size: int = 16 << 20, raw=None, dataset: str = "yellow"):
+    """Parse the CSV with arrow's multithreaded reader, yielding pandas chunks.
+
+    Arrow record batches are regrouped to exactly chunksize rows so chunk
+    indexes line up with the pandas backend.
+    """
+    reader = pacsv.open_csv(
+        open_source(url, raw),
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=block_size),
+        convert_options=pacsv.ConvertOptions(
+            column_types=schemas.arrow_types(dataset),
+            strings_can_be_null=True,
+        ),
     )
 
-    print(f"Inserted first chunk: {len(first_chunk)}")
+    pending = []
+    pending_rows = 0
+    offset = 0
+
+    def to_chunk(table):
+        df_chunk = table.to_pandas(types_mapper=schemas.PANDAS_TYPES.get)
+        df_chunk.index = pd.RangeIndex(offset, offset + len(df_chunk))
+        return df_chunk
+
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+
+        while pending_rows >= chunksize:
+            table = pa.Table.from_batches(pending, schema=reader.schema)
+            yield to_chunk(table.slice(0, chunksize))
+            offset += chunksize
+
+            rest = table.slice(chunksize)
+            pending = rest.to_batches()
+            pending_rows = rest.num_rows
+
+    if pending_rows:
+        yield to_chunk(pa.Table.from_batches(pending, schema=reader.schema))
+
+
+def read_csv_chunks(url: str, chunksize: int = 100000, reader: str = "pandas", metrics: IngestMetrics = None,
+                    dataset: str = "yellow"):
+    """Iterate parsed DataFrame chunks of the CSV with the chosen backend.
+
+    With metrics, the source is read through a CountingReader so each chunk's
+    I/O time and bytes are recorded apart from its parse time.
+    """
+    dtype = schemas.pandas_dtypes(dataset)
+    parse_dates = schemas.timestamp_columns(dataset)
+
+    if metrics is None:
+        if reader == "arrow":
+            return read_csv_arrow(url, chunksize, dataset=dataset)
+        return pd.read_csv(
+            url,
+            dtype=dtype,
+            parse_dates=parse_dates,
+            iterator=True,
+            chunksize=chunksize
+        )
+
+    raw = CountingReader(open_raw(url))
+    if reader == "arrow":
+        df_iter = read_csv_arrow(url, chunksize, raw=raw, dataset=dataset)
+    else:
+        df_iter = pd.read_csv(
+            raw,
+            compression="gzip" if url.endswith(".gz") else None,
+            dtype=dtype,
+            parse_dates=parse_dates,
+            iterator=True,
+            chunksize=chunksize
+        )
+    return metrics.timed_chunks(df_iter, raw)
 
-    for df_chunk in tqdm(df_iter):
-        df_chunk.to_sql(
+
+def create_table_sql(target_table: str, columns, dataset: str = "yellow") -> str:
+    """Build the CREATE TABLE statement for the COPY loaders."""
+    column_defs = ",\n    ".join(
+        f'"{column}" {column_pg_type(column, dataset)}' for column in columns
+    )
+    return f'CREATE TABLE "{target_table}" (\n    {column_defs}\n)'
+
+
+def copy_chunk(conn, df_chunk: pd.DataFrame, target_table: str, copy_format: str = "text", dataset: str = "yellow"):
+    """Stream one chunk into PostgreSQL with COPY ... FROM STDIN (caller commits)."""
+    columns = ", ".join(f'"{column}"' for column in df_chunk.columns)
+
+    with conn.cursor() as cur:
+        if copy_format == "binary":
+            sql = f'COPY "{target_table}" ({columns}) FROM STDIN (FORMAT BINARY)'
+            with cur.copy(sql) as copy:
+                copy.set_types([column_pg_type(column, dataset) for column in df_chunk.columns])
+                rows = df_chunk.astype(object).where(df_chunk.notna(), None)
+                for row in rows.itertuples(index=False, name=None):
+                    copy.write_row(row)
+        else:
+            # CSV is the text format that handles quoting; empty fields load as NULL
+            sql = f'COPY "{target_table}" ({columns}) FROM STDIN (FORMAT CSV)'
+            buffer = io.StringIO()
+            df_chunk.to_csv(buffer, index=False, header=False)
+            with cur.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def create_table(engine, df_chunk: pd.DataFrame, target_table: str, loader: str, dataset: str = "yellow"):
+    """Drop and recreate the target table from the first chunk."""
+    if loader == "to_sql":
+        df_chunk.head(0).to_sql(
             name=target_table,
             con=engine,
-            if_exists="append"
+            if_exists="replace"
         )
-        print(f"Inserted chunk: {len(df_chunk)}")
+    else:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{target_table}"')
+            conn.exec_driver_sql(create_table_sql(target_table, df_chunk.columns, dataset))
+
+
+def load_chunk(engine, df_chunk: pd.DataFrame, target_table: str, loader: str,
+               source: str, chunk_index: int, fingerprint: str, metrics: IngestMetrics = None,
+               dataset: str = "yellow"):
+    """Write one chunk and its manifest row in a single transaction."""
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        if loader == "to_sql":
+            df_chunk.to_sql(
+                name=target_table,
+                con=conn,
+                if_exists="append"
+            )
+        else:
+            copy_chunk(conn.connection.driver_connection, df_chunk, target_table, loader.removeprefix("copy-"), dataset)
+        record_chunk(conn, source, target_table, chunk_index, fingerprint, len(df_chunk))
+    if metrics is not None:
+        metrics.written(chunk_index, len(df_chunk), time.perf_counter() - t0)
 
-    print(f'done ingesting to {target_table}')
+
+def ingest_data(
+        url: str,
+        engine,
+        target_table: str,
+        chunksize: int = 100000,
+        loader: str = "to_sql",
+        writers: int = 0,
+        queue_depth: int = 4,
+        resume: bool = True,
+        reader: str = "pandas",
+        metrics: IngestMetrics = None,
+        dataset: str = "yellow",
+) -> int:
+    """Load the CSV chunks the manifest does not have yet; returns the rows loaded (0 when up to date)."""
+    # Without a caller-supplied collector the summary is printed here
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = IngestMetrics(f"ingest_data_{dataset}", target_table)
+
+    # Closed on every exit (up to date, reload, error), so the log and summary are flushed
+    try:
+        df_iter = read_csv_chunks(url, chunksize, reader, metrics, dataset)
+
+        if not resume:
+            reset_manifest(engine, url, target_table)
+        loaded = loaded_chunks(engine, url, target_table)
+
+        chunks = pending_chunks(df_iter, loaded)
+
+        try:
+            first = next(chunks, None)
+            if first is None:
+                print(f'{target_table} is up to date with {url}')
+                return 0
+
+            if not loaded:
+                create_table(engine, first[2], target_table, loader, dataset)
+                print(f"Table {target_table} created")
+            else:
+                print(f"Resuming {target_table}: {len(loaded)} chunks already loaded")
+
+            chunks = itertools.chain([first], chunks)
+
+            if writers > 0:
+                total_rows = ingest_data_pipelined(
+                    chunks=chunks,
+                    engine=engine,
+                    target_table=target_table,
+                    loader=loader,
+                    source=url,
+                    writers=writers,
+                    queue_depth=queue_depth,
+                    metrics=metrics,
+                    dataset=dataset,
+                )
+            else:
+                total_rows = 0
+                for chunk_index, fingerprint, df_chunk in tqdm(chunks):
+                    load_chunk(engine, df_chunk, target_table, loader, url, chunk_index, fingerprint, metrics, dataset)
+                    total_rows += len(df_chunk)
+                    print(f"Inserted chunk {chunk_index}: {len(df_chunk)}")
+        except SourceChanged as e:
+            print(f"{url} changed since the last load ({e}), reloading from scratch")
+            return ingest_data(url, engine, target_table, chunksize, loader, writers, queue_depth,
+                               resume=False, reader=reader, metrics=None if own_metrics else metrics, dataset=dataset)
+
+        print(f'done ingesting {total_rows} rows to {target_table}')
+        return total_rows
+    finally:
+        if own_metrics:
+            metrics.close()
+
+
+def _put_chunk(chunks: queue.Queue, item, futures):
+    """Block until the queue has room, surfacing writer errors instead of hanging."""
+    while True:
+        try:
+            chunks.put(item, timeout=1)
+            return
+        except queue.Full:
+            for future in futures:
+                if future.done():
+                    future.result()
+
+
+def _stop_writers(chunks: queue.Queue, futures):
+    """Queue one sentinel per writer, giving up once no writer is left to read it."""
+    for _ in futures:
+        while not all(future.done() for future in futures):
+            try:
+                chunks.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+
+
+def _write_chunks(chunks: queue.Queue, engine, target_table: str, loader: str, source: str,
+                  metrics: IngestMetrics = None, dataset: str = "yellow") -> int:
+    """Writer stage: drain the queue until the sentinel, one transaction per chunk."""
+    total_rows = 0
+
+    while True:
+        item = chunks.get()
+        if item is None:
+            return total_rows
+
+        chunk_index, fingerprint, df_chunk = item
+        load_chunk(engine, df_chunk, target_table, loader, source, chunk_index, fingerprint, metrics, dataset)
+        total_rows += len(df_chunk)
+        print(f"Wrote chunk {chunk_index}: {len(df_chunk)}")
+
+
+def ingest_data_pipelined(
+        chunks,
+        engine,
+        target_table: str,
+        loader: str = "to_sql",
+        source: str = "",
+        writers: int = 1,
+        queue_depth: int = 4,
+        metrics: IngestMetrics = None,
+        dataset: str = "yellow",
+) -> int:
+    """Parse chunks in this thread while writer threads load them.
+
+    At most queue_depth parsed chunks wait in memory, plus one per writer.
+    """
+    pending = queue.Queue(maxsize=queue_depth)
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        futures = [
+            executor.submit(_write_chunks, pending, engine, target_table, loader, source, metrics, dataset)
+            for _ in range(writers)
+        ]
+
+        try:
+            for item in tqdm(chunks):
+                _put_chunk(pending, item, futures)
+        finally:
+            _stop_writers(pending, futures)
+
+        return sum(future.result() for future in futures)
 
 @click.command()
 @click.option('--pg-user', default='root', help='PostgreSQL username')
@@ -82,20 +338,54 @@ def ingest_data(
 @click.option('--year', default=2021, type=int, help='Year of the data')
 @click.option('--month', default=1, type=int, help='Month of the data')
 @click.option('--chunksize', default=100000, type=int, help='Chunk size for ingestion')
-@click.option('--target-table', default='yellow_taxi_data', help='Target table name')
-def main(pg_user, pg_pass, pg_host, pg_port, pg_db, year, month, chunksize, target_table):
-
-    engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
-    url_prefix = 'https://github.com/DataTalksClub/nyc-tlc-data/releases/download/yellow'
-
-    url = f'{url_prefix}/yellow_tripdata_{year:04d}-{month:02d}.csv.gz'
-
-    ingest_data(
-        url=url,
-        engine=engine,
-        target_table=target_table,
-        chunksize=chunksize
+@click.option('--dataset', default='yellow', type=click.Choice(list(schemas.SCHEMAS)), help='TLC dataset: selects the CSV schema and the default target table')
+@click.option('--target-table', default=None, help='Target table name (default: the dataset\'s table in schemas.TARGET_TABLES)')
+@click.option('--loader', default='to_sql', type=click.Choice(LOADERS), help='How chunks are written to PostgreSQL')
+@click.option('--writers', default=0, type=int, help='Writer threads draining the chunk queue (0 = parse and write in turn)')
+@click.option('--queue-depth', default=4, type=int, help='Parsed chunks buffered ahead of the writers')
+@click.option('--resume/--no-resume', default=True, help='Skip chunks already recorded in the load manifest')
+@click.option('--reader', default='pandas', type=click.Choice(READERS), help='CSV parser backend')
+@click.option('--build-indexes/--no-build-indexes', default=True, help='Build indexes and run ANALYZE after the load')
+@click.option('--metrics-log', default='ingest_metrics.jsonl', help='JSON-lines file that gets one record per chunk')
+@click.option('--prom-file', default=None, help='Prometheus textfile-collector file to write, e.g. /var/lib/node_exporter/textfile/ingest.prom')
+def main(pg_user, pg_pass, pg_host, pg_port, pg_db, year, month, chunksize, dataset, target_table, loader, writers, queue_depth, resume, reader, build_indexes, metrics_log, prom_file):
+
+    engine = create_engine(
+        f'postgresql+psycopg://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}',
+        pool_size=max(writers, 5)
     )
+    url_prefix = f'https://github.com/DataTalksClub/nyc-tlc-data/releases/download/{dataset}'
+
+    url = f'{url_prefix}/{dataset}_tripdata_{year:04d}-{month:02d}.csv.gz'
+    target_table = target_table or schemas.TARGET_TABLES[dataset]
+
+    metrics = IngestMetrics(f"ingest_data_{dataset}", target_table, log_path=metrics_log, prom_path=prom_file)
+
+    t0 = time.perf_counter()
+    try:
+        rows_loaded = ingest_data(
+            url=url,
+            engine=engine,
+            target_table=target_table,
+            chunksize=chunksize,
+            loader=loader,
+            writers=writers,
+            queue_depth=queue_depth,
+            resume=resume,
+            reader=reader,
+            metrics=metrics,
+            dataset=dataset
+        )
+    finally:
+        metrics.close()
+    load_seconds = time.perf_counter() - t0
+
+    # Indexes are built only now, so the bulk load never maintains them;
+    # an unchanged table keeps the indexes and statistics it already has
+    if build_indexes and rows_loaded:
+        post_load(engine, target_table, load_seconds)
+    elif build_indexes:
+        print(f"{target_table} unchanged, skipping the post-load stage")
 
 if __name__ == '__main__':
     main()
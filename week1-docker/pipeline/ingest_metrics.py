@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Per-chunk throughput metrics for the ingest scripts.
+
+Every chunk is split into three stages: read (I/O on the source, still
+compressed), parse (decompression and conversion to a DataFrame) and write
+(to_sql / COPY plus the manifest row). Each finished chunk becomes one JSON
+line in the metrics log; at the end of the run a Prometheus textfile-collector
+file is written and a summary with p50/p95 chunk latency is printed.
+"""
+
+import io
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+STAGES = ["read", "parse", "write"]
+
+
+class CountingReader(io.RawIOBase):
+    """Wrap a binary stream, counting the bytes read and the seconds spent reading."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        t0 = time.perf_counter()
+        n = self.raw.readinto(buffer)
+        self.seconds += time.perf_counter() - t0
+        self.bytes += n or 0
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class StageTimer:
+    """Accumulate seconds per stage, e.g. over the batches of one row group.
+
+    The write stage may wrap the whole transaction (so commit time counts);
+    split() then subtracts the read and parse time spent inside it.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - t0
+
+    def split(self) -> tuple:
+        """(read, parse, write) seconds, with write net of the stages nested inside it."""
+        read_s, parse_s, write_s = (self.seconds[stage] for stage in STAGES)
+        return read_s, parse_s, max(write_s - read_s - parse_s, 0.0)
+
+    def timed_iter(self, items, name: str):
+        """Yield from items, charging the time spent in next() to one stage."""
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                item = next(items, None)
+            if item is None:
+                return
+            yield item
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile (q in 0..100) of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class IngestMetrics:
+    """Collects one record per loaded chunk; safe to share between writer threads."""
+
+    def __init__(self, job: str, target_table: str, log_path: str = None, prom_path: str = None):
+        self.job = job
+        self.target_table = target_table
+        self.prom_path = prom_path
+        self.records = []
+        self.started = time.perf_counter()
+        self._parsed = {}
+        self._lock = threading.Lock()
+        self._log = open(log_path, "a") if log_path else None
+
+    def timed_chunks(self, chunks, source: CountingReader):
+        """Time each chunk of a reader: I/O on source is read, the rest of next() is parse.
+
+        Readers buffer ahead, so bytes and read time are attributed to the
+        chunk during whose next() call they happened.
+        """
+        chunks = iter(chunks)
+        chunk_index = 0
+        while True:
+            t0 = time.perf_counter()
+            read_before, bytes_before = source.seconds, source.bytes
+            df_chunk = next(chunks, None)
+            if df_chunk is None:
+                return
+            read_s = source.seconds - read_before
+            parse_s = max(time.perf_counter() - t0 - read_s, 0.0)
+            self.parsed(chunk_index, read_s, parse_s, source.bytes - bytes_before)
+            yield df_chunk
+            chunk_index += 1
+
+    def parsed(self, chunk_index: int, read_s: float, parse_s: float, nbytes: int):
+        """Remember the read side of a chunk until it is written."""
+        with self._lock:
+            self._parsed[chunk_index] = (read_s, parse_s, nbytes)
+
+    def written(self, chunk_index: int, rows: int, write_s: float):
+        """Complete a chunk started with parsed()."""
+        with self._lock:
+            read_s, parse_s, nbytes = self._parsed.pop(chunk_index, (0.0, 0.0, 0))
+        self.record(chunk_index, rows, nbytes, read_s, parse_s, write_s)
+
+    def record(self, chunk_index: int, rows: int, nbytes: int, read_s: float, parse_s: float, write_s: float):
+        """Add one finished chunk and append it to the JSON-lines log."""
+        latency_s = read_s + parse_s + write_s
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "job": self.job,
+            "target_table": self.target_table,
+            "chunk": chunk_index,
+            "rows": rows,
+            "bytes": nbytes,
+            "read_s": round(read_s, 6),
+            "parse_s": round(parse_s, 6),
+            "write_s": round(write_s, 6),
+            "latency_s": round(latency_s, 6),
+            "rows_per_s": round(rows / latency_s, 1) if latency_s else None,
+            "bytes_per_s": round(nbytes / latency_s, 1) if latency_s else None,
+        }
+        with self._lock:
+            self.records.append(record)
+            if self._log is not None:
+                self._log.write(json.dumps(record) + "\n")
+                self._log.flush()
+
+    def totals(self) -> dict:
+        """Run totals: rows, bytes, chunks, wall seconds and seconds per stage."""
+        totals = {
+            "rows": sum(record["rows"] for record in self.records),
+            "bytes": sum(record["bytes"] for record in self.records),
+            "chunks": len(self.records),
+            "wall_s": time.perf_counter() - self.started,
+        }
+        for stage in STAGES:
+            totals[f"{stage}_s"] = sum(record[f"{stage}_s"] for record in self.records)
+        return totals
+
+    def write_prometheus(self, path: str):
+        """Write the run as a textfile-collector file (atomically, so node_exporter never sees half a file)."""
+        totals = self.totals()
+        labels = f'job="{self.job}",table="{self.target_table}"'
+        latencies = [record["latency_s"] for record in self.records]
+
+        lines = [
+            "# HELP tlc_ingest_rows Rows written by the last run.",
+            "# TYPE tlc_ingest_rows gauge",
+            f"tlc_ingest_rows{{{labels}}} {totals['rows']}",
+            "# HELP tlc_ingest_bytes Source bytes read by the last run.",
+            "# TYPE tlc_ingest_bytes gauge",
+            f"tlc_ingest_bytes{{{labels}}} {totals['bytes']}",
+            "# HELP tlc_ingest_duration_seconds Wall clock time of the last run.",
+            "# TYPE tlc_ingest_duration_seconds gauge",
+            f"tlc_ingest_duration_seconds{{{labels}}} {totals['wall_s']:.3f}",
+            "# HELP tlc_ingest_stage_seconds Time spent per stage, summed over chunks.",
+            "# TYPE tlc_ingest_stage_seconds gauge",
+        ]
+        for stage in STAGES:
+            lines.append(f'tlc_ingest_stage_seconds{{{labels},stage="{stage}"}} {totals[stage + "_s"]:.3f}')
+
+        lines += [
+            "# HELP tlc_ingest_chunk_latency_seconds Read + parse + write time per chunk.",
+            "# TYPE tlc_ingest_chunk_latency_seconds summary",
+        ]
+        if latencies:
+            for q in (0.5, 0.95):
+                lines.append(f'tlc_ingest_chunk_latency_seconds{{{labels},quantile="{q}"}} '
+                             f'{percentile(latencies, q * 100):.6f}')
+        lines += [
+            f"tlc_ingest_chunk_latency_seconds_sum{{{labels}}} {sum(latencies):.6f}",
+            f"tlc_ingest_chunk_latency_seconds_count{{{labels}}} {len(latencies)}",
+            "# HELP tlc_ingest_last_run_timestamp_seconds When the last run finished.",
+            "# TYPE tlc_ingest_last_run_timestamp_seconds gauge",
+            f"tlc_ingest_last_run_timestamp_seconds{{{labels}}} {time.time():.0f}",
+        ]
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".prom.tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def summary(self):
+        """Print totals, the time split between stages and p50/p95 chunk latency."""
+        totals = self.totals()
+        print(f"\nIngest metrics for {self.target_table} ({self.job})")
+        print(f"  {totals['rows']:,} rows, {totals['bytes'] / 1024 ** 2:.1f} MB in {totals['chunks']} chunks, "
+              f"{totals['wall_s']:.1f} s wall ({totals['rows'] / totals['wall_s']:,.0f} rows/s)")
+        if not self.records:
+            return
+
+        busy = sum(totals[f"{stage}_s"] for stage in STAGES) or 1.0
+        print(f"\n  {'stage':<8} {'seconds':>9} {'share':>7} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage in STAGES + ["latency"]:
+            values = [record[f"{stage}_s"] for record in self.records]
+            share = f"{sum(values) / busy:>6.0%}" if stage != "latency" else ""
+            print(f"  {stage:<8} {sum(values):>9.2f} {share:>7} "
+                  f"{percentile(values, 50) * 1000:>9.1f} {percentile(values, 95) * 1000:>9.1f}")
+
+        rates = [record["rows_per_s"] for record in self.records if record["rows_per_s"]]
+        if rates:
+            print(f"\n  rows/s per chunk: p50 {percentile(rates, 50):,.0f}, p5 {percentile(rates, 5):,.0f}")
+
+    def close(self):
+        """Write the Prometheus file, print the summary and close the log."""
+        if self.prom_path:
+            self.write_prometheus(self.prom_path)
+        self.summary()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -1,48 +1,219 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import pandas as pd
-from sqlalchemy import create_engine
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, text
 from tqdm.auto import tqdm
 
+import schemas
+from ingest_metrics import IngestMetrics, StageTimer
+from load_manifest import (
+    is_stale,
+    loaded_chunks,
+    loaded_rows,
+    move_manifest,
+    record_chunk,
+    reset_manifest,
+    row_group_fingerprint,
+)
+from post_load import post_load
+
+# Engine of the current pool worker, created once per process
+_worker_engine = None
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def row_group_bytes(metadata, i: int) -> int:
+    """Compressed size of a row group in the file (what has to be read from disk)"""
+    row_group = metadata.row_group(i)
+    return sum(row_group.column(j).total_compressed_size for j in range(row_group.num_columns))
+
 def ingest_parquet_to_db(
     file_path: str,
     engine,
     target_table: str,
     chunksize: int = 100000,
+    columns: list = None,
+    workers: int = 0,
+    dataset: str = "yellow",
+    metrics: IngestMetrics = None,
 ):
-    """Ingest parquet file to database table"""
+    """Ingest parquet file to database table, one record batch at a time"""
+    if workers > 0:
+        return ingest_parquet_parallel(file_path, engine, target_table, chunksize, columns, workers, dataset, metrics)
+
     print(f"Reading parquet file: {file_path}")
     
-    # Read parquet file
-    df = pd.read_parquet(file_path)
+    # Only the footer is read here; data is streamed below
+    parquet_file = pq.ParquetFile(file_path)
+    metadata = parquet_file.metadata
+    
+    print(f"Total records: {metadata.num_rows} in {metadata.num_row_groups} row groups")
+    print(f"Columns: {columns or parquet_file.schema_arrow.names}")
+    
+    # Row groups already committed by an earlier run are skipped
+    fingerprints = [row_group_fingerprint(metadata, i) for i in range(metadata.num_row_groups)]
+    loaded = loaded_chunks(engine, file_path, target_table)
+    if is_stale(loaded, fingerprints):
+        print(f"{file_path} changed since the last load, reloading from scratch")
+        reset_manifest(engine, file_path, target_table)
+        loaded = {}
+    elif len(loaded) == metadata.num_row_groups:
+        print(f"{target_table} is up to date with {file_path}")
+        return
+    
+    if not loaded:
+        # Create table from the schema (empty)
+        create_empty_table(parquet_file, engine, target_table, columns, dataset)
+        print(f"Table {target_table} created")
+    else:
+        print(f"Resuming {target_table}: {len(loaded)} row groups already loaded")
     
-    print(f"Total records: {len(df)}")
-    print(f"Columns: {list(df.columns)}")
+    # Insert data batch by batch; peak memory is bounded by one batch.
+    # Each row group commits together with its manifest row.
+    total_rows = 0
+    for i in tqdm(range(metadata.num_row_groups)):
+        if i in loaded:
+            continue
+        timer = StageTimer()
+        with timer.stage("write"), engine.begin() as conn:
+            rows = load_row_group(parquet_file, i, conn, target_table, columns, chunksize, dataset, timer)
+            record_chunk(conn, file_path, target_table, i, fingerprints[i], rows)
+        total_rows += rows
+        if metrics is not None:
+            metrics.record(i, rows, row_group_bytes(metadata, i), *timer.split())
+        print(f"Inserted row group {i}: {rows} records")
     
-    # Create table with first chunk (empty)
-    df.head(0).to_sql(
-        name=target_table,
+    print(f"Done ingesting {total_rows} records to {target_table} (peak RSS: {peak_rss_mb():.1f} MB)")
+
+def create_empty_table(parquet_file, engine, table_name: str, columns: list = None, dataset: str = "yellow"):
+    """Replace table_name with an empty table matching the parquet schema (compact types)"""
+    schema = parquet_file.schema_arrow
+    if columns:
+        schema = pa.schema([schema.field(name) for name in columns])
+    schemas.to_pandas(schema.empty_table(), dataset).to_sql(
+        name=table_name,
         con=engine,
         if_exists="replace",
         index=False
     )
-    print(f"Table {target_table} created")
-    
-    # Insert data in chunks
-    for i in tqdm(range(0, len(df), chunksize)):
-        chunk = df[i:i+chunksize]
+
+def load_row_group(parquet_file, row_group: int, con, table_name: str, columns: list = None, chunksize: int = 100000,
+                   dataset: str = "yellow", timer: StageTimer = None) -> int:
+    """Append one row group to table_name batch by batch; returns the row count"""
+    timer = timer or StageTimer()
+    rows = 0
+    batches = parquet_file.iter_batches(batch_size=chunksize, row_groups=[row_group], columns=columns)
+    for batch in timer.timed_iter(batches, "read"):
+        with timer.stage("parse"):
+            chunk = schemas.to_pandas(batch, dataset)
         chunk.to_sql(
-            name=target_table,
-            con=engine,
+            name=table_name,
+            con=con,
             if_exists="append",
             index=False
         )
-        print(f"Inserted chunk: {len(chunk)} records")
+        rows += len(chunk)
+    return rows
+
+def _init_worker(engine_url: str):
+    """Give each pool worker its own engine (and so its own connection)"""
+    global _worker_engine
+    _worker_engine = create_engine(engine_url, pool_size=1)
+
+def _load_row_group(file_path, row_group, fingerprint, columns, staging_table, chunksize, dataset):
+    """Stream one row group into the staging table; returns (row group, rows, stage seconds, peak RSS MB)"""
+    parquet_file = pq.ParquetFile(file_path)
+    timer = StageTimer()
+    with timer.stage("write"), _worker_engine.begin() as conn:
+        rows = load_row_group(parquet_file, row_group, conn, staging_table, columns, chunksize, dataset, timer)
+        record_chunk(conn, file_path, staging_table, row_group, fingerprint, rows)
+    return row_group, rows, timer.split(), peak_rss_mb()
+
+def ingest_parquet_parallel(
+    file_path: str,
+    engine,
+    target_table: str,
+    chunksize: int = 100000,
+    columns: list = None,
+    workers: int = 4,
+    dataset: str = "yellow",
+    metrics: IngestMetrics = None,
+):
+    """Load row groups in a process pool into an UNLOGGED staging table, then swap it in"""
+    print(f"Reading parquet file: {file_path}")
+    
+    parquet_file = pq.ParquetFile(file_path)
+    metadata = parquet_file.metadata
+    staging_table = f"{target_table}_staging"
+    
+    print(f"Total records: {metadata.num_rows} in {metadata.num_row_groups} row groups, {workers} workers")
+    
+    fingerprints = [row_group_fingerprint(metadata, i) for i in range(metadata.num_row_groups)]
+    if loaded_chunks(engine, file_path, target_table) == dict(enumerate(fingerprints)):
+        print(f"{target_table} is up to date with {file_path}")
+        return
+    
+    # A staging table left by an interrupted run is reused if it still matches
+    # the file. Unlogged tables are truncated by crash recovery, so the row
+    # count has to agree with the manifest as well.
+    staged = loaded_chunks(engine, file_path, staging_table)
+    if staged:
+        with engine.connect() as conn:
+            staged_rows = conn.execute(text(f'SELECT count(*) FROM "{staging_table}"')).scalar()
+        if is_stale(staged, fingerprints) or staged_rows != loaded_rows(engine, file_path, staging_table):
+            reset_manifest(engine, file_path, staging_table)
+            staged = {}
+    
+    # The target table is left alone until the swap
+    if not staged:
+        create_empty_table(parquet_file, engine, staging_table, columns, dataset)
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE "{staging_table}" SET UNLOGGED'))
+        print(f"Staging table {staging_table} created (unlogged)")
+    else:
+        print(f"Resuming {staging_table}: {len(staged)} row groups already loaded")
+    
+    total_rows = 0
+    worker_peak_mb = 0.0
+    engine_url = engine.url.render_as_string(hide_password=False)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine_url,)) as executor:
+        futures = [
+            executor.submit(_load_row_group, file_path, i, fingerprints[i], columns, staging_table, chunksize, dataset)
+            for i in range(metadata.num_row_groups)
+            if i not in staged
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            row_group, rows, seconds, peak_mb = future.result()
+            total_rows += rows
+            worker_peak_mb = max(worker_peak_mb, peak_mb)
+            if metrics is not None:
+                metrics.record(row_group, rows, row_group_bytes(metadata, row_group), *seconds)
+            print(f"Inserted row group: {rows} records")
     
-    print(f"Done ingesting {len(df)} records to {target_table}")
+    with engine.begin() as conn:
+        # Unlogged tables are emptied on crash recovery, so WAL-log the
+        # finished data once before it becomes the real table
+        conn.execute(text(f'ALTER TABLE "{staging_table}" SET LOGGED'))
+        conn.execute(text(f'DROP TABLE IF EXISTS "{target_table}"'))
+        conn.execute(text(f'ALTER TABLE "{staging_table}" RENAME TO "{target_table}"'))
+        move_manifest(conn, file_path, staging_table, target_table)
+    print(f"Swapped {staging_table} -> {target_table}")
+    
+    print(f"Done ingesting {total_rows} records to {target_table} (peak RSS per worker: {worker_peak_mb:.1f} MB)")
 
-if __name__ == "__main__":
+def run(dataset: str, file_path: str, workers: int = 4, metrics_log: str = "ingest_metrics.jsonl", prom_file: str = None):
+    """Load one TLC parquet file into its dataset's table, then build indexes"""
     # Database connection parameters
     pg_user = 'root'
     pg_pass = 'root' 
@@ -53,14 +224,30 @@ if __name__ == "__main__":
     # Create database engine
     engine = create_engine(f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
     
-    # File path and target table
-    file_path = '/Users/joeunsung/git/data-engineering-zoomcamp-2026/week1-docker/pipeline/yellow_tripdata_2025-11.parquet'
-    target_table = 'yellow_taxi_trips'
-    
-    # Ingest data
-    ingest_parquet_to_db(
-        file_path=file_path,
-        engine=engine,
-        target_table=target_table,
-        chunksize=100000
-    )
\ No newline at end of file
+    target_table = schemas.TARGET_TABLES[dataset]
+    
+    metrics = IngestMetrics(f"ingest_parquet_{dataset}", target_table, log_path=metrics_log, prom_path=prom_file)
+    
+    # Ingest data (workers=0 loads over a single connection)
+    t0 = time.perf_counter()
+    try:
+        ingest_parquet_to_db(
+            file_path=file_path,
+            engine=engine,
+            target_table=target_table,
+            chunksize=100000,
+            workers=workers,
+            dataset=dataset,
+            metrics=metrics
+        )
+    finally:
+        metrics.close()
+    
+    # Build indexes and statistics after the bulk load
+    post_load(engine, target_table, time.perf_counter() - t0)
+
+if __name__ == "__main__":
+    run(
+        dataset='yellow',
+        file_path='/Users/joeunsung/git/data-engineering-zoomcamp-2026/week1-docker/pipeline/yellow_tripdata_2025-11.parquet'
+    )
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Load manifest: which chunks / row groups of a source are already committed.
+
+Every chunk is written in the same transaction as its manifest row, so after
+a crash the manifest lists exactly the chunks that made it into the table.
+"""
+
+import hashlib
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+MANIFEST_TABLE = "ingest_manifest"
+
+
+class SourceChanged(Exception):
+    """A chunk that was loaded before has a different fingerprint now, or is gone."""
+
+
+def chunk_fingerprint(df_chunk: pd.DataFrame) -> str:
+    """Content hash of a parsed chunk."""
+    row_hashes = pd.util.hash_pandas_object(df_chunk, index=False)
+    return hashlib.sha1(row_hashes.values.tobytes()).hexdigest()
+
+
+def row_group_fingerprint(metadata, row_group: int) -> str:
+    """Hash of a parquet row group computed from the footer alone."""
+    rg = metadata.row_group(row_group)
+    parts = [rg.num_rows, rg.total_byte_size]
+    for i in range(rg.num_columns):
+        column = rg.column(i)
+        parts += [column.path_in_schema, column.total_compressed_size, column.file_offset]
+        if column.is_stats_set:
+            stats = column.statistics
+            parts += [stats.null_count, stats.min if stats.has_min_max else None,
+                      stats.max if stats.has_min_max else None]
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def ensure_manifest(engine):
+    """Create the manifest table on first use."""
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                source TEXT NOT NULL,
+                target_table TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                fingerprint TEXT NOT NULL,
+                rows BIGINT NOT NULL,
+                loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (source, target_table, chunk_index)
+            )
+        """))
+
+
+def reset_manifest(engine, source: str, target_table: str):
+    """Forget everything loaded from source into target_table."""
+    ensure_manifest(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"DELETE FROM {MANIFEST_TABLE} WHERE source = :source AND target_table = :target_table"),
+            {"source": source, "target_table": target_table},
+        )
+
+
+def loaded_chunks(engine, source: str, target_table: str) -> dict:
+    """Map chunk index -> fingerprint of the chunks already in target_table."""
+    ensure_manifest(engine)
+
+    # A manifest without its table (e.g. dropped by hand) means nothing is loaded
+    if not inspect(engine).has_table(target_table):
+        reset_manifest(engine, source, target_table)
+        return {}
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"""
+                SELECT chunk_index, fingerprint FROM {MANIFEST_TABLE}
+                WHERE source = :source AND target_table = :target_table
+            """),
+            {"source": source, "target_table": target_table},
+        )
+        return dict(rows.all())
+
+
+def loaded_rows(engine, source: str, target_table: str) -> int:
+    """Total rows the manifest says are in target_table."""
+    with engine.connect() as conn:
+        return conn.execute(
+            text(f"""
+                SELECT coalesce(sum(rows), 0) FROM {MANIFEST_TABLE}
+                WHERE source = :source AND target_table = :target_table
+            """),
+            {"source": source, "target_table": target_table},
+        ).scalar()
+
+
+def is_stale(loaded: dict, fingerprints: list) -> bool:
+    """True when a loaded chunk no longer matches the source's fingerprints."""
+    return any(
+        chunk_index >= len(fingerprints) or fingerprints[chunk_index] != fingerprint
+        for chunk_index, fingerprint in loaded.items()
+    )
+
+
+def record_chunk(conn, source: str, target_table: str, chunk_index: int, fingerprint: str, rows: int):
+    """Mark a chunk as loaded; call inside the transaction that wrote it."""
+    conn.execute(
+        text(f"""
+            INSERT INTO {MANIFEST_TABLE} (source, target_table, chunk_index, fingerprint, rows)
+            VALUES (:source, :target_table, :chunk_index, :fingerprint, :rows)
+            ON CONFLICT (source, target_table, chunk_index)
+            DO UPDATE SET fingerprint = excluded.fingerprint, rows = excluded.rows, loaded_at = now()
+        """),
+        {
+            "source": source,
+            "target_table": target_table,
+            "chunk_index": chunk_index,
+            "fingerprint": fingerprint,
+            "rows": rows,
+        },
+    )
+
+
+def move_manifest(conn, source: str, from_table: str, to_table: str):
+    """Re-key manifest rows after from_table was renamed to to_table."""
+    params = {"source": source, "from_table": from_table, "to_table": to_table}
+    conn.execute(
+        text(f"DELETE FROM {MANIFEST_TABLE} WHERE source = :source AND target_table = :to_table"),
+        params,
+    )
+    conn.execute(
+        text(f"""
+            UPDATE {MANIFEST_TABLE} SET target_table = :to_table
+            WHERE source = :source AND target_table = :from_table
+        """),
+        params,
+    )
+
+
+def pending_chunks(chunks, loaded: dict):
+    """Yield (index, fingerprint, chunk) for chunks not yet loaded.
+
+    Raises SourceChanged when a previously loaded chunk no longer matches, or
+    when the source ends before the last chunk the manifest has loaded.
+    """
+    read = 0
+    for chunk_index, df_chunk in enumerate(chunks):
+        read = chunk_index + 1
+        fingerprint = chunk_fingerprint(df_chunk)
+        if chunk_index in loaded:
+            if loaded[chunk_index] != fingerprint:
+                raise SourceChanged(f"chunk {chunk_index} changed since it was loaded")
+            print(f"Skipped chunk {chunk_index}: already loaded")
+            continue
+        yield chunk_index, fingerprint, df_chunk
+
+    if loaded and max(loaded) >= read:
+        raise SourceChanged(f"source now has {read} chunks, the manifest has loaded up to chunk {max(loaded)}")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Post-load stage: build indexes and statistics once the bulk load is done.
+
+Indexes are never present while rows are being loaded; they are built here in
+parallel, one connection per index, followed by ANALYZE. Plain CREATE INDEX
+takes a SHARE lock, which does not conflict with itself, so several builds on
+the same table run side by side (CREATE INDEX CONCURRENTLY would serialize).
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from sqlalchemy import create_engine, inspect, text
+
+def find_pickup_column(engine, target_table: str) -> str:
+    """tpep_pickup_datetime for yellow, lpep_pickup_datetime for green, ..."""
+    columns = [column["name"] for column in inspect(engine).get_columns(target_table)]
+    return next(column for column in columns if column.lower().endswith("pickup_datetime"))
+
+
+def find_location_columns(engine, target_table: str) -> tuple:
+    """(pickup, dropoff) location columns: PULocationID / DOLocationID, or PUlocationID / DOlocationID for fhv."""
+    columns = [column["name"] for column in inspect(engine).get_columns(target_table)]
+    return tuple(
+        next(column for column in columns if column.lower() == name)
+        for name in ("pulocationid", "dolocationid")
+    )
+
+
+def index_statements(target_table: str, pickup_column: str, location_columns: tuple) -> dict:
+    """Index name -> CREATE INDEX statement: BRIN on pickup time, B-tree on locations."""
+    statements = {
+        f"{target_table}_{pickup_column}_brin":
+            f'CREATE INDEX IF NOT EXISTS "{target_table}_{pickup_column}_brin" '
+            f'ON "{target_table}" USING brin ("{pickup_column}")',
+    }
+    for column in location_columns:
+        statements[f"{target_table}_{column}_idx"] = (
+            f'CREATE INDEX IF NOT EXISTS "{target_table}_{column}_idx" '
+            f'ON "{target_table}" USING btree ("{column}")'
+        )
+    return statements
+
+
+def reference_queries(engine, target_table: str, pickup_column: str, location_columns: tuple) -> dict:
+    """A few typical downstream queries: one pickup day, one pickup zone, one dropoff zone.
+
+    An empty table has no pickup day to pick, so only the zone queries are returned.
+    """
+    pickup_location, dropoff_location = location_columns
+    with engine.connect() as conn:
+        day = conn.execute(text(
+            f'SELECT date_trunc(\'day\', percentile_disc(0.5) WITHIN GROUP (ORDER BY "{pickup_column}")) '
+            f'FROM "{target_table}"'
+        )).scalar()
+
+    queries = {}
+    if day is not None:
+        queries["one pickup day"] = (
+            f'SELECT count(*) FROM "{target_table}" '
+            f'WHERE "{pickup_column}" >= \'{day}\' AND "{pickup_column}" < timestamp \'{day}\' + interval \'1 day\''
+        )
+    queries["one pickup zone"] = f'SELECT count(*) FROM "{target_table}" WHERE "{pickup_location}" = 132'
+    queries["one dropoff zone"] = f'SELECT count(*) FROM "{target_table}" WHERE "{dropoff_location}" = 132'
+    return queries
+
+
+def time_queries(engine, queries: dict) -> dict:
+    """Query name -> server-side execution time in ms, from EXPLAIN ANALYZE."""
+    timings = {}
+    with engine.connect() as conn:
+        for name, query in queries.items():
+            plan = conn.execute(text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")).scalar()
+            timings[name] = plan[0]["Execution Time"]
+    return timings
+
+
+def _build_index(engine, statement: str, maintenance_work_mem: str) -> float:
+    t0 = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"SET maintenance_work_mem = '{maintenance_work_mem}'"))
+        conn.execute(text(statement))
+    return time.perf_counter() - t0
+
+
+def build_indexes(engine, target_table: str, pickup_column: str = None, location_columns: tuple = None,
+                  maintenance_work_mem: str = "256MB") -> dict:
+    """Build all indexes in parallel on separate connections, then ANALYZE; returns timings in seconds."""
+    pickup_column = pickup_column or find_pickup_column(engine, target_table)
+    location_columns = location_columns or find_location_columns(engine, target_table)
+    statements = index_statements(target_table, pickup_column, location_columns)
+
+    with ThreadPoolExecutor(max_workers=len(statements)) as executor:
+        futures = {
+            name: executor.submit(_build_index, engine, statement, maintenance_work_mem)
+            for name, statement in statements.items()
+        }
+        timings = {name: future.result() for name, future in futures.items()}
+
+    t0 = time.perf_counter()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f'ANALYZE "{target_table}"'))
+    timings["ANALYZE"] = time.perf_counter() - t0
+
+    return timings
+
+
+def post_load(engine, target_table: str, load_seconds: float = None, pickup_column: str = None):
+    """Run the post-load stage and print load time, build times and query speedups."""
+    pickup_column = pickup_column or find_pickup_column(engine, target_table)
+    location_columns = find_location_columns(engine, target_table)
+    queries = reference_queries(engine, target_table, pickup_column, location_columns)
+
+    before = time_queries(engine, queries)
+    t0 = time.perf_counter()
+    timings = build_indexes(engine, target_table, pickup_column, location_columns)
+    build_seconds = time.perf_counter() - t0
+    after = time_queries(engine, queries)
+
+    print(f"\nPost-load report for {target_table}")
+    if load_seconds is not None:
+        print(f"  Bulk load:      {load_seconds:.1f} s")
+    with engine.connect() as conn:
+        table_bytes = conn.execute(text(f"SELECT pg_table_size('\"{target_table}\"')")).scalar()
+        index_bytes = conn.execute(text(f"SELECT pg_indexes_size('\"{target_table}\"')")).scalar()
+    print(f"  Table size:     {table_bytes / 1024 ** 2:.1f} MB (+ {index_bytes / 1024 ** 2:.1f} MB indexes)")
+    print(f"  Index + stats:  {build_seconds:.1f} s (wall clock, indexes built in parallel)")
+    for name, seconds in timings.items():
+        print(f"    {name:<45} {seconds:.1f} s")
+
+    print(f"\n  {'reference query':<20} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for name in queries:
+        print(f"  {name:<20} {before[name]:>10.1f} {after[name]:>10.1f} {before[name] / after[name]:>7.1f}x")
+
+
+@click.command()
+@click.option('--pg-user', default='root', help='PostgreSQL username')
+@click.option('--pg-pass', default='root', help='PostgreSQL password')
+@click.option('--pg-host', default='localhost', help='PostgreSQL host')
+@click.option('--pg-port', default='5432', help='PostgreSQL port')
+@click.option('--pg-db', default='ny_taxi', help='PostgreSQL database name')
+@click.option('--target-table', default='yellow_taxi_data', help='Table to index')
+def main(pg_user, pg_pass, pg_host, pg_port, pg_db, target_table):
+    engine = create_engine(f'postgresql+psycopg://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}')
+    post_load(engine, target_table)
+
+
+if __name__ == '__main__':
+    main()
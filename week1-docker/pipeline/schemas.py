@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""Per-dataset column types for the TLC trip files (yellow, green, fhv).
+
+Each column maps to a compact type name, and TYPES says what that type is in
+pandas (in memory), in arrow (parsing / parquet batches) and in PostgreSQL
+(on disk). IDs and flags use small integers, store_and_fwd_flag is
+categorical, and float32 is used only for trip_distance. Money columns stay
+float64 because SUM() over a real column in PostgreSQL returns real, and
+monthly revenue totals would lose cents. Columns not listed here keep
+whatever type the source has.
+"""
+
+import pandas as pd
+import pyarrow as pa
+
+# type name -> (pandas dtype, arrow type, PostgreSQL type)
+TYPES = {
+    "int16": ("Int16", pa.int16(), "smallint"),
+    "int32": ("Int32", pa.int32(), "integer"),
+    "float32": ("float32", pa.float32(), "real"),
+    "float64": ("float64", pa.float64(), "double precision"),
+    "category": ("category", pa.dictionary(pa.int32(), pa.string()), "text"),
+    "string": ("string", pa.string(), "text"),
+    "timestamp": ("datetime64[us]", pa.timestamp("us"), "timestamp"),
+}
+
+# Nullable pandas dtypes for arrow integer columns (to_pandas would give float64)
+PANDAS_TYPES = {
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.string(): pd.StringDtype(),
+}
+
+MONEY = [
+    "fare_amount",
+    "extra",
+    "mta_tax",
+    "tip_amount",
+    "tolls_amount",
+    "improvement_surcharge",
+    "total_amount",
+    "congestion_surcharge",
+]
+
+SCHEMAS = {
+    "yellow": {
+        "VendorID": "int16",
+        "tpep_pickup_datetime": "timestamp",
+        "tpep_dropoff_datetime": "timestamp",
+        "passenger_count": "int16",
+        "trip_distance": "float32",
+        "RatecodeID": "int16",
+        "store_and_fwd_flag": "category",
+        "PULocationID": "int16",
+        "DOLocationID": "int16",
+        "payment_type": "int16",
+        **{column: "float64" for column in MONEY},
+        "Airport_fee": "float64",
+        "cbd_congestion_fee": "float64",
+    },
+    "green": {
+        "VendorID": "int16",
+        "lpep_pickup_datetime": "timestamp",
+        "lpep_dropoff_datetime": "timestamp",
+        "store_and_fwd_flag": "category",
+        "RatecodeID": "int16",
+        "PULocationID": "int16",
+        "DOLocationID": "int16",
+        "passenger_count": "int16",
+        "trip_distance": "float32",
+        **{column: "float64" for column in MONEY},
+        "ehail_fee": "float64",
+        "payment_type": "int16",
+        "trip_type": "int16",
+        "cbd_congestion_fee": "float64",
+    },
+    "fhv": {
+        "dispatching_base_num": "string",
+        "pickup_datetime": "timestamp",
+        "dropOff_datetime": "timestamp",
+        "PUlocationID": "int16",
+        "DOlocationID": "int16",
+        "SR_Flag": "int16",
+        "Affiliated_base_number": "string",
+    },
+}
+
+# Default target tables, matching the tables used in the homework
+TARGET_TABLES = {
+    "yellow": "yellow_taxi_trips",
+    "green": "green_taxi_trips",
+    "fhv": "fhv_taxi_trips",
+}
+
+
+def pandas_dtypes(dataset: str) -> dict:
+    """dtype map for pd.read_csv (timestamps are left to parse_dates)."""
+    return {
+        column: TYPES[type_name][0]
+        for column, type_name in SCHEMAS[dataset].items()
+        if type_name != "timestamp"
+    }
+
+
+def timestamp_columns(dataset: str) -> list:
+    """Columns to parse as timestamps (parse_dates for pd.read_csv)."""
+    return [column for column, type_name in SCHEMAS[dataset].items() if type_name == "timestamp"]
+
+
+def arrow_types(dataset: str) -> dict:
+    """Arrow type of every registered column."""
+    return {column: TYPES[type_name][1] for column, type_name in SCHEMAS[dataset].items()}
+
+
+def pg_type(dataset: str, column: str, default: str = "text") -> str:
+    """PostgreSQL type of a column, or default for unregistered columns."""
+    type_name = SCHEMAS[dataset].get(column)
+    return TYPES[type_name][2] if type_name else default
+
+
+def cast_batch(batch, dataset: str):
+    """Cast the registry's columns of an arrow batch/table to their compact types."""
+    types = arrow_types(dataset)
+    schema = pa.schema([
+        field.with_type(types.get(field.name, field.type)) for field in batch.schema
+    ])
+    return batch.cast(schema)
+
+
+def to_pandas(batch, dataset: str) -> pd.DataFrame:
+    """Convert an arrow batch to pandas with the registry's compact dtypes."""
+    return cast_batch(batch, dataset).to_pandas(types_mapper=PANDAS_TYPES.get)
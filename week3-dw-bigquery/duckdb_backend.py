@@ -0,0 +1,190 @@
+"""
+Offline stand-in for the BigQuery client: runs the homework queries with DuckDB.
+
+Only the calls run_homework_queries.py makes are implemented. Tables are
+emulated with local parquet layouts under LAYOUT_DIR/<dataset>/<table>/:
+
+- external tables read the downloaded yellow_tripdata_2024-*.parquet files
+  in DATA_DIR directly (the gs:// source URIs are mapped by file name)
+- CREATE OR REPLACE TABLE ... AS SELECT writes one parquet file
+- PARTITION BY DATE(col) writes one hive directory per day, and queries on
+  the table use that directory for pruning; CLUSTER BY sorts the rows in
+  each partition, so parquet row-group statistics can skip on those columns
+
+Bytes processed are the bytes DuckDB actually read from disk for the query
+(the process' rchar counter, Linux only). A dry run executes the query and
+reports the same number, except for external tables, which report 0 like
+BigQuery does.
+
+Usage:
+    QUERY_BACKEND=duckdb python3 run_homework_queries.py
+"""
+import datetime
+import glob
+import json
+import os
+import re
+import shutil
+import threading
+from types import SimpleNamespace
+
+import duckdb
+from google.api_core.exceptions import NotFound
+
+DATA_DIR = os.environ.get("LOCAL_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+LAYOUT_DIR = os.environ.get("LOCAL_LAYOUT_DIR", os.path.join(DATA_DIR, "local_tables"))
+
+PARTITION_COLUMN = "_partition_date"
+
+TABLE_REF = re.compile(r"`([\w-]+)\.(\w+)\.(\w+)`")
+CREATE_TABLE = re.compile(
+    r"^\s*CREATE\s+OR\s+REPLACE\s+TABLE\s+`[\w-]+\.(\w+)\.(\w+)`\s*"
+    r"(?:PARTITION\s+BY\s+(.+?)\s*)?(?:CLUSTER\s+BY\s+(.+?)\s*)?AS\s+(SELECT\s.+)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def bytes_read():
+    """Bytes this process has read so far (Linux /proc/self/io), or None elsewhere."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+class LocalQueryJob:
+    """The parts of bigquery.QueryJob the runner reads."""
+
+    def __init__(self, rows, total_bytes_processed):
+        self._rows = rows
+        self.total_bytes_processed = total_bytes_processed
+
+    def result(self):
+        return self._rows
+
+
+class DuckDBClient:
+    """Runs BigQuery-flavoured homework SQL against local parquet layouts."""
+
+    project = "local"
+
+    def __init__(self, data_dir=DATA_DIR, layout_dir=LAYOUT_DIR):
+        self.data_dir = data_dir
+        self.layout_dir = layout_dir
+        self._con = duckdb.connect()
+        # Every query reads from disk, so bytes read are comparable between runs
+        self._con.execute("SET enable_external_file_cache = false")
+        # rchar is per process, so queries run one at a time (each one uses all cores)
+        self._lock = threading.Lock()
+        if bytes_read() is None:
+            print("Warning: /proc/self/io is not available, bytes processed are reported as 0")
+
+    def _table_dir(self, dataset_id, table_id):
+        return os.path.join(self.layout_dir, dataset_id, table_id)
+
+    def _table_meta(self, dataset_id, table_id):
+        path = os.path.join(self._table_dir(dataset_id, table_id), "_table.json")
+        if not os.path.exists(path):
+            raise NotFound(f"Not found: Table {self.project}.{dataset_id}.{table_id}")
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_meta(self, dataset_id, table_id, meta):
+        with open(os.path.join(self._table_dir(dataset_id, table_id), "_table.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def _pattern(self, dataset_id, table_id, meta):
+        if meta["kind"] == "external":
+            return os.path.join(self.data_dir, meta["pattern"])
+        return os.path.join(self._table_dir(dataset_id, table_id), "**", "*.parquet")
+
+    def _scan(self, dataset_id, table_id, meta):
+        """read_parquet() expression for a table."""
+        pattern = self._pattern(dataset_id, table_id, meta)
+        if not glob.glob(pattern, recursive=True):
+            raise NotFound(f"No parquet files for {self.project}.{dataset_id}.{table_id} ({pattern})")
+        hive = ", hive_partitioning = true" if meta.get("partition_by") else ""
+        return f"read_parquet('{pattern}'{hive})"
+
+    def _translate(self, sql):
+        """Replace `project.dataset.table` references with local scans; True if one is external."""
+        external = False
+        for project, dataset_id, table_id in set(TABLE_REF.findall(sql)):
+            meta = self._table_meta(dataset_id, table_id)
+            external = external or meta["kind"] == "external"
+            sql = sql.replace(f"`{project}.{dataset_id}.{table_id}`", self._scan(dataset_id, table_id, meta))
+            if meta.get("partition_by"):
+                # Filters on the partitioning expression use the hive directory instead
+                pattern = r"\s*".join(re.escape(part) for part in meta["partition_by"].split())
+                sql = re.sub(pattern, PARTITION_COLUMN, sql, flags=re.IGNORECASE)
+        return sql, external
+
+    def _run(self, sql):
+        """(rows as dicts, bytes read) for one statement."""
+        with self._lock:
+            before = bytes_read()
+            cursor = self._con.execute(sql)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            after = bytes_read()
+        return rows, (after - before) if before is not None else 0
+
+    def create_dataset(self, dataset, exists_ok=False):
+        os.makedirs(os.path.join(self.layout_dir, dataset.dataset_id), exist_ok=True)
+        return dataset
+
+    def create_table(self, table, exists_ok=False):
+        """External tables only; the gs:// source URIs are matched by file name in DATA_DIR."""
+        table_dir = self._table_dir(table.dataset_id, table.table_id)
+        if os.path.exists(os.path.join(table_dir, "_table.json")) and exists_ok:
+            return table
+        (uri,) = table.external_data_configuration.source_uris
+        os.makedirs(table_dir, exist_ok=True)
+        self._write_meta(table.dataset_id, table.table_id, {"kind": "external", "pattern": os.path.basename(uri)})
+        return table
+
+    def get_table(self, table_ref):
+        """Namespace with the attributes QueryCache reads; modified is the newest file of the table."""
+        _, dataset_id, table_id = table_ref.split(".")
+        meta = self._table_meta(dataset_id, table_id)
+        paths = glob.glob(self._pattern(dataset_id, table_id, meta), recursive=True)
+        paths.append(os.path.join(self._table_dir(dataset_id, table_id), "_table.json"))
+        modified = max(os.path.getmtime(path) for path in paths)
+        return SimpleNamespace(
+            modified=datetime.datetime.fromtimestamp(modified, datetime.timezone.utc),
+            external_data_configuration=None,
+        )
+
+    def _create_table_as(self, match):
+        dataset_id, table_id, partition_by, cluster_by, select = match.groups()
+        source, _ = self._translate(select)
+
+        table_dir = self._table_dir(dataset_id, table_id)
+        shutil.rmtree(table_dir, ignore_errors=True)
+        os.makedirs(table_dir)
+
+        order = f" ORDER BY {cluster_by}" if cluster_by else ""
+        if partition_by:
+            copy = (f"COPY (SELECT *, {partition_by} AS {PARTITION_COLUMN} FROM ({source}){order}) "
+                    f"TO '{table_dir}' (FORMAT parquet, PARTITION_BY ({PARTITION_COLUMN}), OVERWRITE_OR_IGNORE)")
+        else:
+            copy = f"COPY (SELECT * FROM ({source}){order}) TO '{os.path.join(table_dir, 'data.parquet')}' (FORMAT parquet)"
+        _, read = self._run(copy)
+
+        self._write_meta(dataset_id, table_id, {"kind": "native", "partition_by": partition_by, "cluster_by": cluster_by})
+        return LocalQueryJob([], read)
+
+    def query(self, sql, job_config=None):
+        match = CREATE_TABLE.match(sql)
+        if match:
+            return self._create_table_as(match)
+
+        sql, external = self._translate(sql)
+        rows, read = self._run(sql)
+        if job_config is not None and job_config.dry_run:
+            # BigQuery cannot estimate external tables and reports 0 bytes
+            return LocalQueryJob([], 0 if external else read)
+        return LocalQueryJob(rows, read)
@@ -0,0 +1,361 @@
+"""
+Recommend a BigQuery partition / cluster layout from parquet row-group statistics.
+
+Only the parquet footers are read: for every row group, the row count,
+the size of every column and its min / max / null-count statistics. The
+workload is a JSON list of representative queries, each with the columns
+it selects, a WHERE clause and a weight (see layout_workload.json).
+
+Every candidate layout (no partitioning, or DATE / month partitioning on a
+timestamp column, times no clustering or clustering on one filtered column)
+gets a predicted number of bytes scanned per query, the way BigQuery bills
+it: the logical size of every referenced column, 8 bytes per numeric or
+timestamp value, for the rows in the partitions and cluster blocks the
+query cannot skip. Inside a row group values are assumed to be spread
+evenly between min and max. Clustering cannot skip below
+CLUSTER_BLOCK_BYTES per partition, so it only helps large partitions.
+
+Supported predicates, joined with AND:
+    col = v, col <> v, col < v, col <= v, col > v, col >= v,
+    col BETWEEN a AND b, col IN (a, b, ...), col IS [NOT] NULL,
+    and DATE(col) in place of col for timestamp columns.
+
+Usage:
+    python3 layout_advisor.py [workload.json] [parquet glob]
+"""
+import datetime
+import glob
+import json
+import os
+import re
+import sys
+
+import pyarrow.parquet as pq
+
+DATA_DIR = os.environ.get("LOCAL_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_GLOB = os.path.join(DATA_DIR, "yellow_tripdata_2024-*.parquet")
+DEFAULT_WORKLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "layout_workload.json")
+
+# Smallest unit of data BigQuery clustering can skip within one partition
+CLUSTER_BLOCK_BYTES = int(os.environ.get("CLUSTER_BLOCK_BYTES", 64 * 1024 * 1024))
+
+# Layouts listed in the ranking
+TOP = 10
+
+DAY = 86400
+INF = float("inf")
+
+TERM = re.compile(
+    r"^(?:(?P<func>DATE)\((?P<fcol>\w+)\)|(?P<col>\w+))\s*"
+    r"(?:(?P<op><=|>=|<>|!=|=|<|>)\s*(?P<value>.+)"
+    r"|BETWEEN\s+(?P<low>.+?)\s+AND\s+(?P<high>.+)"
+    r"|IN\s*\((?P<values>.+)\)"
+    r"|(?P<is_null>IS\s+(?P<neg>NOT\s+)?NULL))$",
+    re.IGNORECASE,
+)
+
+
+def _epoch(value):
+    """Seconds since 1970 for a datetime / date, as the row-group statistics are compared."""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return _epoch(datetime.datetime.combine(value, datetime.time()))
+    return value
+
+
+class Column:
+    """Type of one column: 'int', 'float', 'timestamp' or 'string'."""
+
+    def __init__(self, name, arrow_type):
+        self.name = name
+        text = str(arrow_type)
+        if text.startswith("timestamp") or text.startswith("date"):
+            self.kind = "timestamp"
+        elif text.startswith(("int", "uint", "bool")):
+            self.kind = "int"
+        elif text.startswith(("double", "float", "decimal")):
+            self.kind = "float"
+        else:
+            self.kind = "string"
+
+    def literal(self, text):
+        text = text.strip()
+        if text[:1] in "'\"":
+            text = text[1:-1]
+        if self.kind == "timestamp":
+            return _epoch(datetime.datetime.fromisoformat(text))
+        if self.kind == "int":
+            return int(float(text))
+        if self.kind == "float":
+            return float(text)
+        return text
+
+
+class RowGroup:
+    """Footer statistics of one row group: rows, per-column logical bytes and (min, max, nulls)."""
+
+    def __init__(self, metadata, columns):
+        self.rows = metadata.num_rows
+        self.bytes = {}
+        self.stats = {}
+        for j in range(metadata.num_columns):
+            chunk = metadata.column(j)
+            name = chunk.path_in_schema
+            column = columns[name]
+            if column.kind == "string":
+                # STRING is 2 bytes + the UTF-8 length; the plain-encoded size is close to that
+                self.bytes[name] = chunk.total_uncompressed_size + 2 * self.rows
+            else:
+                self.bytes[name] = 8 * self.rows
+            stats = chunk.statistics
+            if stats is not None and stats.has_min_max:
+                self.stats[name] = (_epoch(stats.min), _epoch(stats.max), stats.null_count or 0)
+            else:
+                self.stats[name] = None
+
+
+def read_row_groups(paths):
+    """(columns by name, [RowGroup]) from the footers of every file."""
+    columns = {}
+    row_groups = []
+    for path in paths:
+        metadata = pq.read_metadata(path)
+        for field in metadata.schema.to_arrow_schema():
+            columns.setdefault(field.name, Column(field.name, field.type))
+        row_groups.extend(RowGroup(metadata.row_group(i), columns) for i in range(metadata.num_row_groups))
+    return columns, row_groups
+
+
+def _intersect(a, b):
+    """Intersection of two interval lists; a point (lo == hi) survives only inside the other side."""
+    result = []
+    for lo1, hi1 in a:
+        for lo2, hi2 in b:
+            lo, hi = max(lo1, lo2), min(hi1, hi2)
+            if lo < hi or (lo == hi and lo1 <= lo <= hi1 and lo2 <= lo <= hi2 and (lo1 == hi1 or lo2 == hi2)):
+                result.append((lo, hi))
+    return result
+
+
+def parse_where(where, columns):
+    """{column: {"intervals": [(lo, hi)] or None, "null": None / True / False}} for a conjunction."""
+    # Split on AND, but not the AND of a BETWEEN
+    parts = re.split(r"\s+AND\s+", where.strip(), flags=re.IGNORECASE)
+    terms = []
+    for part in parts:
+        if terms and re.search(r"\bBETWEEN\s+\S+$", terms[-1], re.IGNORECASE):
+            terms[-1] += f" AND {part}"
+        else:
+            terms.append(part)
+
+    filters = {}
+    for term in terms:
+        match = TERM.match(term.strip())
+        if match is None:
+            raise ValueError(f"Unsupported predicate: {term}")
+        name = match["fcol"] or match["col"]
+        if name not in columns:
+            raise ValueError(f"Unknown column in predicate: {term}")
+        column = columns[name]
+        entry = filters.setdefault(name, {"intervals": None, "null": None})
+
+        if match["is_null"]:
+            entry["null"] = match["neg"] is None
+            continue
+
+        if column.kind == "string":
+            # Only equality can rule out a row group by its string min / max
+            values = match["values"].split(",") if match["values"] is not None else [match["value"]] if match["op"] == "=" else []
+            if values:
+                points = [(v, v) for v in map(column.literal, values)]
+                entry["intervals"] = points if entry["intervals"] is None else [p for p in points if p in entry["intervals"]]
+            continue
+
+        # Integers cover [v, v + 1), so equality is an interval of width one
+        step = 1 if column.kind == "int" else 0
+        if match["func"]:
+            step = DAY
+            literal = lambda text: column.literal(text) // DAY * DAY
+        else:
+            literal = column.literal
+
+        if match["values"] is not None:
+            intervals = [(v, v + step) for v in map(literal, match["values"].split(","))]
+        elif match["low"] is not None:
+            intervals = [(literal(match["low"]), literal(match["high"]) + step)]
+        else:
+            op, v = match["op"], literal(match["value"])
+            intervals = {
+                "=": [(v, v + step)],
+                "<>": [(-INF, v), (v + step, INF)],
+                "!=": [(-INF, v), (v + step, INF)],
+                "<": [(-INF, v)],
+                "<=": [(-INF, v + step)],
+                ">": [(v + step, INF)],
+                ">=": [(v, INF)],
+            }[op]
+        entry["intervals"] = intervals if entry["intervals"] is None else _intersect(entry["intervals"], intervals)
+    return filters
+
+
+def _fraction(row_group, column, name, entry):
+    """Share of a row group's rows matching one column's filter, assuming values spread evenly."""
+    stats = row_group.stats.get(name)
+    if stats is None:
+        return 1.0
+    low, high, nulls = stats
+    null_share = nulls / row_group.rows if row_group.rows else 0.0
+    if entry["null"] is True:
+        return null_share
+    share = 1.0 - null_share
+    if entry["intervals"] is None:
+        return share
+
+    if column.kind == "string":
+        return share if any(lo <= high and low <= hi for lo, hi in entry["intervals"]) else 0.0
+
+    if column.kind == "int":
+        high = high + 1
+    width = high - low
+    covered = 0.0
+    for lo, hi in entry["intervals"]:
+        if width == 0:
+            covered = 1.0 if lo <= low <= hi else covered
+        else:
+            covered += max(0.0, min(hi, high) - max(lo, low)) / width
+    return share * min(covered, 1.0)
+
+
+def _expand(intervals, granularity):
+    """Widen intervals (epoch seconds) to whole days / months: what partition pruning keeps."""
+    def floor(t):
+        if t in (-INF, INF):
+            return t
+        d = datetime.datetime.fromtimestamp(t, datetime.timezone.utc)
+        d = d.replace(hour=0, minute=0, second=0, microsecond=0)
+        if granularity == "MONTH":
+            d = d.replace(day=1)
+        return d.timestamp()
+
+    def ceil(t):
+        start = floor(t)
+        if start in (-INF, INF) or start == t:
+            return start
+        if granularity == "DAY":
+            return start + DAY
+        d = datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+        return d.replace(year=d.year + d.month // 12, month=d.month % 12 + 1).timestamp()
+
+    return [(floor(lo), ceil(hi) if hi > lo else floor(lo) + DAY) for lo, hi in intervals]
+
+
+class Layout:
+    """One candidate: partition column + granularity (or None) and cluster column (or None)."""
+
+    def __init__(self, partition=None, granularity=None, cluster=None):
+        self.partition = partition
+        self.granularity = granularity
+        self.cluster = cluster
+
+    def ddl(self):
+        parts = []
+        if self.partition:
+            expr = f"DATE({self.partition})" if self.granularity == "DAY" else f"TIMESTAMP_TRUNC({self.partition}, MONTH)"
+            parts.append(f"PARTITION BY {expr}")
+        if self.cluster:
+            parts.append(f"CLUSTER BY {self.cluster}")
+        return " ".join(parts) or "(no partitioning or clustering)"
+
+    def predict(self, query, columns, row_groups, partition_count):
+        """Predicted bytes scanned by one workload query."""
+        filters = parse_where(query["where"], columns)
+        referenced = set(query["columns"]) | set(filters)
+        table_bytes = sum(sum(rg.bytes.values()) for rg in row_groups)
+        # Clustering skips at most down to one block of each partition that is read
+        block_floor = min(1.0, CLUSTER_BLOCK_BYTES * partition_count / table_bytes) if table_bytes else 1.0
+
+        scanned = 0.0
+        for rg in row_groups:
+            share = 1.0
+            if self.partition and self.partition in filters and filters[self.partition]["intervals"]:
+                entry = dict(filters[self.partition], intervals=_expand(filters[self.partition]["intervals"], self.granularity))
+                share = _fraction(rg, columns[self.partition], self.partition, entry)
+            if self.cluster and self.cluster in filters and share > 0:
+                cluster_share = _fraction(rg, columns[self.cluster], self.cluster, filters[self.cluster])
+                share *= max(cluster_share, block_floor)
+            scanned += share * sum(rg.bytes.get(name, 0) for name in referenced)
+        return scanned
+
+
+def _partition_count(row_groups, column, granularity):
+    """Partitions a layout would create, from the timestamp range of the column."""
+    ranges = [rg.stats[column] for rg in row_groups if rg.stats.get(column)]
+    if not ranges:
+        return 1
+    low, high = min(r[0] for r in ranges), max(r[1] for r in ranges)
+    if granularity == "DAY":
+        return int((high - low) // DAY) + 1
+    start = datetime.datetime.fromtimestamp(low, datetime.timezone.utc)
+    end = datetime.datetime.fromtimestamp(high, datetime.timezone.utc)
+    return (end.year - start.year) * 12 + end.month - start.month + 1
+
+
+def candidate_layouts(columns, workload):
+    filtered = set()
+    for query in workload:
+        filtered |= set(parse_where(query["where"], columns))
+    partitions = [(None, None)] + [
+        (name, granularity)
+        for name in sorted(filtered) if columns[name].kind == "timestamp"
+        for granularity in ("DAY", "MONTH")
+    ]
+    clusters = [None] + sorted(filtered)
+    return [Layout(p, g, c) for p, g in partitions for c in clusters]
+
+
+def advise(workload, paths):
+    """[(Layout, weighted bytes, {query name: bytes})] ranked from cheapest to most expensive."""
+    columns, row_groups = read_row_groups(paths)
+    results = []
+    for layout in candidate_layouts(columns, workload):
+        partitions = _partition_count(row_groups, layout.partition, layout.granularity) if layout.partition else 1
+        per_query = {q["name"]: layout.predict(q, columns, row_groups, partitions) for q in workload}
+        total = sum(per_query[q["name"]] * q.get("weight", 1) for q in workload)
+        results.append((layout, total, per_query))
+    # On a tie the simpler layout wins
+    return sorted(results, key=lambda result: (round(result[1]), bool(result[0].partition) + bool(result[0].cluster)))
+
+
+def _mb(num_bytes):
+    return f"{num_bytes / 1024 ** 2:,.1f} MB"
+
+
+if __name__ == "__main__":
+    workload_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_WORKLOAD
+    paths = sorted(glob.glob(sys.argv[2] if len(sys.argv) > 2 else DEFAULT_GLOB))
+    if not paths:
+        sys.exit("No parquet files found; download them first (TRANSFER_MODE=files python3 load_yellow_taxi_data.py)")
+
+    with open(workload_path) as f:
+        workload = json.load(f)
+
+    print(f"Advising on {len(paths)} files and {len(workload)} queries (footers only)\n")
+    ranked = advise(workload, paths)
+    baseline = next(total for layout, total, _ in ranked if layout.partition is None and layout.cluster is None)
+
+    print(f"{'rank':<5} {'weighted bytes':>16} {'saving':>8}  layout")
+    for rank, (layout, total, _) in enumerate(ranked, 1):
+        if rank > TOP and (layout.partition or layout.cluster):
+            continue
+        saving = 1 - total / baseline if baseline else 0.0
+        print(f"{rank:<5} {_mb(total):>16} {saving:>8.0%}  {layout.ddl()}")
+
+    best, best_total, per_query = ranked[0]
+    _, _, baseline_per_query = next(r for r in ranked if r[0].partition is None and r[0].cluster is None)
+    print(f"\nRecommended: {best.ddl()}")
+    for query in workload:
+        name = query["name"]
+        print(f"  {name:<45} {_mb(baseline_per_query[name]):>12} -> {_mb(per_query[name]):>12}")
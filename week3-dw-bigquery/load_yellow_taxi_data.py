@@ -1,46 +1,67 @@
+import functools
+import io
 import os
+import queue
 import sys
-import requests
+import threading
+import urllib.request
 from concurrent.futures import ThreadPoolExecutor
 from google.cloud import storage
 from google.api_core.exceptions import NotFound, Forbidden
 import time
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.download_cache import fetch, head
+from common.gcs_index import blob_index
+from common.gcs_sync import SyncStats, sync_file
+
 
 # Change this to your bucket name
 BUCKET_NAME = "data-engineering-zoomcamp-2026"
 
 # If you authenticated through the GCP SDK you can comment out these two lines
 CREDENTIALS_FILE = "gcs.json"
-client = storage.Client.from_service_account_json(CREDENTIALS_FILE)
+if os.environ.get("STORAGE_EMULATOR_HOST"):
+    # Local GCS emulator (e.g. fake-gcs-server): anonymous credentials
+    client = storage.Client()
+else:
+    client = storage.Client.from_service_account_json(CREDENTIALS_FILE)
 # If commented initialize client with the following
 # client = storage.Client(project='zoomcamp-mod3-datawarehouse')
 
 
-BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_2024-"
+BASE_URL = os.environ.get("TLC_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data") + "/yellow_tripdata_2024-"
 MONTHS = [f"{i:02d}" for i in range(1, 7)]
+# Remote state for the skip-unchanged checks comes from one listing of this prefix
+BLOB_PREFIX = "yellow_tripdata_"
 DOWNLOAD_DIR = "."
 
+# "files" (default) downloads everything to DOWNLOAD_DIR first and uploads
+# afterwards; "stream" pipes each HTTP response straight into a GCS resumable
+# upload without touching local disk. The stream cannot be rewound, so a
+# failed chunk restarts the whole month instead of resuming the session.
+TRANSFER_MODE = os.environ.get("TRANSFER_MODE", "files")
+
 CHUNK_SIZE = 8 * 1024 * 1024
+# Streaming buffer per month: at most BUFFER_BLOCKS blocks of READ_SIZE wait
+# between download and upload, plus the CHUNK_SIZE part being uploaded
+READ_SIZE = 1024 * 1024
+BUFFER_BLOCKS = 8
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 bucket = client.bucket(BUCKET_NAME)
 
+# Bytes skipped vs uploaded, printed at the end of the run
+sync_stats = SyncStats()
+
 
 def download_file(month):
     url = f"{BASE_URL}{month}.parquet"
-    file_path = os.path.join(DOWNLOAD_DIR, f"yellow_tripdata_2024-{month}.parquet")
 
     try:
-        print(f"Downloading {url}...")
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-
+        # Served from the shared download cache when the file is unchanged
+        file_path = fetch(url, dest_dir=DOWNLOAD_DIR)
         print(f"Downloaded: {file_path}")
         return file_path
     except Exception as e:
@@ -48,6 +69,8 @@ def download_file(month):
         return None
 
 
+# Checked once per process; later calls (one per upload) return immediately
+@functools.cache
 def create_bucket(bucket_name):
     try:
         # Get bucket details
@@ -77,24 +100,24 @@ def create_bucket(bucket_name):
         sys.exit(1)
 
 
-def verify_gcs_upload(blob_name):
-    return storage.Blob(bucket=bucket, name=blob_name).exists(client)
+def verify_gcs_upload(blob, expected_size):
+    # The upload response already carries the object's metadata, so this
+    # needs no extra round trip
+    return blob.size == expected_size
 
 
 def upload_to_gcs(file_path, max_retries=3):
     blob_name = os.path.basename(file_path)
-    blob = bucket.blob(blob_name)
-    blob.chunk_size = CHUNK_SIZE
 
     create_bucket(BUCKET_NAME)
 
     for attempt in range(max_retries):
         try:
-            print(f"Uploading {file_path} to {BUCKET_NAME} (Attempt {attempt + 1})...")
-            blob.upload_from_filename(file_path)
-            print(f"Uploaded: gs://{BUCKET_NAME}/{blob_name}")
+            print(f"Syncing {file_path} to {BUCKET_NAME} (Attempt {attempt + 1})...")
+            # Skipped when the object already has the same CRC32C / MD5
+            blob = sync_file(bucket, file_path, blob_name, sync_stats, index_prefix=BLOB_PREFIX)
 
-            if verify_gcs_upload(blob_name):
+            if verify_gcs_upload(blob, os.path.getsize(file_path)):
                 print(f"Verification successful for {blob_name}")
                 return
             else:
@@ -107,13 +130,147 @@ def upload_to_gcs(file_path, max_retries=3):
     print(f"Giving up on {file_path} after {max_retries} attempts.")
 
 
+class QueueStream(io.RawIOBase):
+    """Readable stream over the blocks of a download running in another thread.
+
+    The downloader is throttled by the bounded queue. read(n) only returns
+    fewer than n bytes at the end of the body, because the resumable upload
+    takes a short chunk as the last one.
+    """
+
+    def __init__(self, response, size=None):
+        self.response = response
+        self.size = size
+        self.blocks = queue.Queue(maxsize=BUFFER_BLOCKS)
+        self.stop = threading.Event()
+        self.position = 0
+        self.pending = b""
+        self.done = False
+        self.reader = threading.Thread(target=self._download, daemon=True)
+        self.reader.start()
+
+    def _put(self, item):
+        """Wait for room in the queue, giving up once the upload side has stopped."""
+        while not self.stop.is_set():
+            try:
+                self.blocks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _download(self):
+        try:
+            received = 0
+            while not self.stop.is_set():
+                block = self.response.read(READ_SIZE)
+                if not block:
+                    break
+                received += len(block)
+                self._put(block)
+            if self.size is not None and received != self.size:
+                raise IOError(f"Incomplete download: {received:,} of {self.size:,} bytes")
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        parts = [self.pending]
+        available = len(self.pending)
+        while not self.done and (size < 0 or available < size):
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if block is None:
+                self.done = True
+                break
+            parts.append(block)
+            available += len(block)
+
+        data = b"".join(parts)
+        if size >= 0:
+            data, self.pending = data[:size], data[size:]
+        else:
+            self.pending = b""
+        self.position += len(data)
+        return data
+
+    def close(self):
+        self.stop.set()
+        self.reader.join()
+        super().close()
+
+
+def stream_to_gcs(month, max_retries=3):
+    """Pipe one month from the TLC server into a resumable upload; returns the blob name or None."""
+    url = f"{BASE_URL}{month}.parquet"
+    blob_name = os.path.basename(url)
+    blob = bucket.blob(blob_name)
+    # Sent as a resumable upload, one CHUNK_SIZE part at a time
+    blob.chunk_size = CHUNK_SIZE
+    index = blob_index(bucket, BLOB_PREFIX)
+
+    # There is no local file to checksum, so a streamed object remembers the
+    # source ETag and is skipped while a HEAD request still reports it
+    existing = index.get(blob_name)
+    remote = head(url) if existing is not None else None
+    if remote is not None:
+        size, etag, _, _ = remote
+        if etag and existing.size == size and (existing.metadata or {}).get("source-etag") == etag:
+            print(f"Unchanged, skipping: gs://{BUCKET_NAME}/{blob_name}")
+            sync_stats.skipped(size)
+            return blob_name
+
+    for attempt in range(max_retries):
+        try:
+            print(f"Streaming {url} to gs://{BUCKET_NAME}/{blob_name} (Attempt {attempt + 1})...")
+            with urllib.request.urlopen(url, timeout=60) as response:
+                size = response.headers.get("Content-Length")
+                size = int(size) if size is not None else None
+                etag = response.headers.get("ETag")
+
+                blob.metadata = {"source-url": url, "source-etag": etag} if etag else None
+                # A failed download raises out of the upload before it is
+                # finalized, so no truncated object is left behind
+                with QueueStream(response, size) as stream:
+                    blob.upload_from_file(stream, size=size, content_type="application/octet-stream")
+                    sent = stream.tell()
+
+            if verify_gcs_upload(blob, sent) and (size is None or sent == size):
+                print(f"Uploaded and verified: gs://{BUCKET_NAME}/{blob_name} ({sent:,} bytes)")
+                index.add(blob)
+                sync_stats.transferred(sent)
+                return blob_name
+            print(f"Verification failed for {blob_name}: {blob.size} of {size or sent} bytes, retrying...")
+        except Exception as e:
+            print(f"Failed to stream {url} to GCS: {e}")
+
+        time.sleep(5)
+
+    print(f"Giving up on {url} after {max_retries} attempts.")
+    return None
+
+
 if __name__ == "__main__":
     create_bucket(BUCKET_NAME)
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        file_paths = list(executor.map(download_file, MONTHS))
+    if TRANSFER_MODE == "stream":
+        # Each worker streams one month, so downloads and uploads of
+        # different months overlap
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(stream_to_gcs, MONTHS))
+    else:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            file_paths = list(executor.map(download_file, MONTHS))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            executor.map(upload_to_gcs, filter(None, file_paths))  # Remove None values
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        executor.map(upload_to_gcs, filter(None, file_paths))  # Remove None values
+    sync_stats.summary()
 
     print("All files processed and verified.")
\ No newline at end of file
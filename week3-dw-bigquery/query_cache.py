@@ -0,0 +1,133 @@
+"""
+Local SQLite cache for the homework queries.
+
+A query's key is its SQL (whitespace collapsed) plus the version of every
+table it references: the table's last-modified time, and for external
+tables the generation of every source object in GCS. The cached value is
+the dry-run byte estimate and, once the query has run, its result rows and
+actual bytes processed. As long as no referenced table changes, a rerun
+answers from the cache without touching BigQuery.
+
+CREATE OR REPLACE TABLE steps are recorded the same way: a build is
+current while the target still exists, was not modified since, and its
+sources have the same version as when it was built.
+
+Set QUERY_CACHE=0 to bypass the cache.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from google.api_core.exceptions import NotFound
+
+CACHE_PATH = os.environ.get("QUERY_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".query_cache.sqlite"))
+ENABLED = os.environ.get("QUERY_CACHE", "1") != "0"
+
+# `project.dataset.table` references, as the runner writes them
+TABLE_REF = re.compile(r"`([\w-]+\.\w+\.\w+)`")
+
+
+def normalize_sql(sql):
+    return " ".join(sql.split())
+
+
+def referenced_tables(sql):
+    return sorted(set(TABLE_REF.findall(sql)))
+
+
+class QueryCache:
+    """Dry-run bytes, result rows and table builds, keyed by SQL and table versions."""
+
+    def __init__(self, client, path=CACHE_PATH, enabled=ENABLED):
+        self.client = client
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._storage = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS queries ("
+                " key TEXT PRIMARY KEY, sql TEXT, dry_run_bytes INTEGER, bytes_processed INTEGER, rows TEXT)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS builds ("
+                " target TEXT PRIMARY KEY, key TEXT, target_modified TEXT)"
+            )
+
+    def _external_version(self, table):
+        """Generations of every GCS object behind an external table."""
+        if self._storage is None:
+            from google.cloud import storage
+            self._storage = storage.Client(project=self.client.project)
+
+        objects = []
+        for uri in table.external_data_configuration.source_uris:
+            bucket_name, pattern = uri[len("gs://"):].split("/", 1)
+            prefix = pattern.split("*", 1)[0]
+            regex = re.compile(re.escape(pattern).replace(r"\*", ".*") + "$")
+            for blob in self._storage.list_blobs(bucket_name, prefix=prefix, fields="items(name,generation),nextPageToken"):
+                if regex.match(blob.name):
+                    objects.append(f"{bucket_name}/{blob.name}#{blob.generation}")
+        return hashlib.sha256("\n".join(sorted(objects)).encode()).hexdigest()
+
+    def table_version(self, table_id):
+        """Last-modified time of a table (plus its GCS sources for external tables); None if missing."""
+        try:
+            table = self.client.get_table(table_id)
+        except NotFound:
+            return None
+        version = table.modified.isoformat()
+        if table.external_data_configuration is not None:
+            version += ":" + self._external_version(table)
+        return version
+
+    def key(self, sql, exclude=()):
+        versions = {table: self.table_version(table) for table in referenced_tables(sql) if table not in exclude}
+        payload = json.dumps({"sql": normalize_sql(sql), "tables": versions}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """{"dry_run_bytes", "bytes_processed", "rows"} for a key, or None; rows is None until the query has run."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT dry_run_bytes, bytes_processed, rows FROM queries WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        dry_run_bytes, bytes_processed, rows = row
+        return {
+            "dry_run_bytes": dry_run_bytes,
+            "bytes_processed": bytes_processed,
+            "rows": json.loads(rows) if rows is not None else None,
+        }
+
+    def put(self, key, sql, dry_run_bytes, bytes_processed=None, rows=None):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)",
+                (key, normalize_sql(sql), dry_run_bytes, bytes_processed,
+                 json.dumps(rows, default=str) if rows is not None else None),
+            )
+
+    def build_is_current(self, target, sql):
+        """True when target was built from sql, is unchanged since, and its sources are unchanged."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            row = self._db.execute("SELECT key, target_modified FROM builds WHERE target = ?", (target,)).fetchone()
+        if row is None:
+            return False
+        key, target_modified = row
+        return self.table_version(target) == target_modified and self.key(sql, exclude=(target,)) == key
+
+    def record_build(self, target, sql):
+        key = self.key(sql, exclude=(target,))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO builds VALUES (?, ?, ?)", (target, key, self.table_version(target))
+            )
@@ -1,18 +1,35 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import bigquery
 from google.api_core.exceptions import NotFound
 
-# GCS 인증 파일 설정
-os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'gcs.json'
+from query_cache import QueryCache
 
-# BigQuery 클라이언트 생성
-client = bigquery.Client()
+# 실행 백엔드: bigquery (기본) 또는 duckdb (로컬 parquet, 오프라인)
+QUERY_BACKEND = os.environ.get("QUERY_BACKEND", "bigquery")
+
+if QUERY_BACKEND == "duckdb":
+    from duckdb_backend import DuckDBClient
+    client = DuckDBClient()
+else:
+    # GCS 인증 파일 설정
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'gcs.json'
+
+    # BigQuery 클라이언트 생성
+    client = bigquery.Client()
+
+# 쿼리 결과 / dry run 캐시 (참조 테이블이 바뀌지 않으면 BigQuery를 다시 호출하지 않음)
+cache = QueryCache(client)
 
 # 프로젝트 ID와 데이터셋 ID
 PROJECT_ID = client.project
 DATASET_ID = "taxi_data"
 BUCKET_NAME = "data-engineering-zoomcamp-2026"
 
+# 동시에 실행할 dry run / 쿼리 수
+QUERY_WORKERS = 8
+
 print(f"Project ID: {PROJECT_ID}")
 print(f"Dataset ID: {DATASET_ID}")
 print("=" * 80)
@@ -45,55 +62,123 @@ def create_external_table():
     except Exception as e:
         print(f"Error creating external table: {e}\n")
 
+# CREATE OR REPLACE TABLE 실행 (소스 테이블이 그대로면 건너뜀)
+def create_or_replace_table(table_id, query):
+    if cache.build_is_current(table_id, query):
+        return False
+    client.query(query).result()
+    cache.record_build(table_id, query)
+    return True
+
 # Materialized Table 생성
 def create_materialized_table():
+    table_id = f"{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized"
     query = f"""
-    CREATE OR REPLACE TABLE `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized` AS
+    CREATE OR REPLACE TABLE `{table_id}` AS
     SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_external`
     """
 
     try:
-        query_job = client.query(query)
-        query_job.result()
-        print(f"✓ Materialized table created\n")
+        if create_or_replace_table(table_id, query):
+            print(f"✓ Materialized table created\n")
+        else:
+            print(f"✓ Materialized table is up to date, skipping CREATE OR REPLACE\n")
     except Exception as e:
         print(f"Error creating materialized table: {e}\n")
 
-# 쿼리 실행 및 결과 출력 (예상 바이트 포함)
-def run_query_with_stats(question_num, description, query):
+# 예상 바이트 (dry run, 캐시 우선)
+def estimate_bytes(query, key=None):
+    key = key or cache.key(query)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["dry_run_bytes"]
+
+    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+    estimated_bytes = client.query(query, job_config=job_config).total_bytes_processed
+    cache.put(key, query, estimated_bytes)
+    return estimated_bytes
+
+# 실행 시간 측정: (결과, 초)
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+# 선행 작업(future)이 끝난 뒤 실행
+def after(future, fn, *args):
+    future.result()
+    return fn(*args)
+
+def format_bytes(num_bytes):
+    if num_bytes >= 1024 ** 3:
+        return f"{num_bytes / 1024 ** 3:.2f} GB ({num_bytes:,} bytes)"
+    return f"{num_bytes / 1024 ** 2:.2f} MB ({num_bytes:,} bytes)"
+
+# 쿼리 실행 (dry run 예상 바이트 포함); 출력은 print_query_stats에서
+def run_query_with_stats(query):
+    key = cache.key(query)
+    cached = cache.get(key)
+
+    # Dry run으로 예상 바이트 확인
+    estimated_bytes, dry_run_seconds = timed(estimate_bytes, query, key)
+
+    # 실제 쿼리 실행 (캐시에 결과가 있으면 생략)
+    t0 = time.perf_counter()
+    if cached is not None and cached["rows"] is not None:
+        rows, bytes_processed = cached["rows"], cached["bytes_processed"]
+    else:
+        query_job = client.query(query)
+        rows = [dict(row) for row in query_job.result()]
+        bytes_processed = query_job.total_bytes_processed
+        cache.put(key, query, estimated_bytes, bytes_processed, rows)
+
+    return {
+        "estimated_bytes": estimated_bytes,
+        "dry_run_seconds": dry_run_seconds,
+        "rows": rows,
+        "bytes_processed": bytes_processed,
+        "seconds": time.perf_counter() - t0,
+        "cached": cached is not None and cached["rows"] is not None,
+    }
+
+def print_header(title):
     print(f"\n{'='*80}")
-    print(f"Question {question_num}: {description}")
+    print(title)
     print(f"{'='*80}")
 
-    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+# 결과 출력 (예상 바이트, 실제 바이트, 쿼리별 소요 시간)
+def print_query_stats(question_num, description, future):
+    print_header(f"Question {question_num}: {description}")
 
     try:
-        # Dry run으로 예상 바이트 확인
-        dry_run_job = client.query(query, job_config=job_config)
-        estimated_bytes = dry_run_job.total_bytes_processed
-        estimated_mb = estimated_bytes / (1024 * 1024)
-        estimated_gb = estimated_bytes / (1024 * 1024 * 1024)
-
-        if estimated_gb >= 1:
-            print(f"Estimated bytes to process: {estimated_gb:.2f} GB ({estimated_bytes:,} bytes)")
-        else:
-            print(f"Estimated bytes to process: {estimated_mb:.2f} MB ({estimated_bytes:,} bytes)")
+        stats = future.result()
+    except Exception as e:
+        print(f"Error: {e}")
+        return
 
-        # 실제 쿼리 실행
-        query_job = client.query(query)
-        results = query_job.result()
+    source = " (cached)" if stats["cached"] else ""
+    print(f"Estimated bytes to process: {format_bytes(stats['estimated_bytes'])} [dry run {stats['dry_run_seconds']:.2f} s]")
 
-        print(f"\nResults:")
-        for row in results:
-            print(f"  {dict(row)}")
+    print(f"\nResults{source}:")
+    for row in stats["rows"]:
+        print(f"  {row}")
 
-        print(f"\nActual bytes processed: {query_job.total_bytes_processed:,}")
+    print(f"\nActual bytes processed: {stats['bytes_processed']:,}{source} [query {stats['seconds']:.2f} s]")
 
-    except Exception as e:
-        print(f"Error: {e}")
+# 예상 바이트 비교 출력; futures는 (라벨, timed(estimate_bytes) future) 목록
+def print_estimates(futures):
+    for label, future in futures:
+        try:
+            num_bytes, seconds = future.result()
+        except Exception as e:
+            print(f"{label}: Error: {e}")
+            continue
+        print(f"{label}: {num_bytes / (1024 * 1024):.2f} MB ({num_bytes:,} bytes) [dry run {seconds:.2f} s]")
 
 # Main execution
 if __name__ == "__main__":
+    t_start = time.perf_counter()
+
     # 1. 데이터셋 생성
     create_dataset()
 
@@ -103,110 +188,100 @@ if __name__ == "__main__":
     # 3. Materialized Table 생성
     create_materialized_table()
 
+    external = f"`{PROJECT_ID}.{DATASET_ID}.yellow_taxi_external`"
+    materialized = f"`{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`"
+    table5 = f"{PROJECT_ID}.{DATASET_ID}.yellow_taxi_partitioned_clustered"
+
     # Question 1: 2024 Yellow Taxi 데이터의 레코드 수
     query1 = f"""
     SELECT COUNT(*) AS record_count
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`
+    FROM {materialized}
     """
-    run_query_with_stats(1, "Total record count for 2024 Yellow Taxi Data", query1)
 
     # Question 2: External Table vs Materialized Table 예상 데이터 읽기량
-    print(f"\n{'='*80}")
-    print(f"Question 2: Estimated bytes - External Table vs Materialized Table")
-    print(f"{'='*80}")
-
     query2_external = f"""
     SELECT COUNT(DISTINCT PULocationID)
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_external`
+    FROM {external}
     """
 
     query2_materialized = f"""
     SELECT COUNT(DISTINCT PULocationID)
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`
+    FROM {materialized}
     """
 
-    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
-
-    # External Table
-    dry_run_external = client.query(query2_external, job_config=job_config)
-    ext_bytes = dry_run_external.total_bytes_processed
-    ext_mb = ext_bytes / (1024 * 1024)
-
-    # Materialized Table
-    dry_run_materialized = client.query(query2_materialized, job_config=job_config)
-    mat_bytes = dry_run_materialized.total_bytes_processed
-    mat_mb = mat_bytes / (1024 * 1024)
-
-    print(f"External Table: {ext_mb:.2f} MB ({ext_bytes:,} bytes)")
-    print(f"Materialized Table: {mat_mb:.2f} MB ({mat_bytes:,} bytes)")
-
     # Question 4: fare_amount가 0인 레코드 수
     query4 = f"""
     SELECT COUNT(*) AS zero_fare_count
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`
+    FROM {materialized}
     WHERE fare_amount = 0
     """
-    run_query_with_stats(4, "Records with fare_amount = 0", query4)
 
     # Question 5: Partitioned and Clustered Table 생성
-    print(f"\n{'='*80}")
-    print(f"Question 5: Creating Partitioned and Clustered Table")
-    print(f"{'='*80}")
-
     query5 = f"""
-    CREATE OR REPLACE TABLE `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_partitioned_clustered`
+    CREATE OR REPLACE TABLE `{table5}`
     PARTITION BY DATE(tpep_dropoff_datetime)
     CLUSTER BY VendorID AS
-    SELECT * FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`
+    SELECT * FROM {materialized}
     """
 
-    try:
-        query_job = client.query(query5)
-        query_job.result()
-        print("✓ Partitioned and clustered table created")
-        print("  Strategy: PARTITION BY tpep_dropoff_datetime, CLUSTER BY VendorID")
-    except Exception as e:
-        print(f"Error: {e}")
-
     # Question 6: Partitioned vs Non-Partitioned 비교
-    print(f"\n{'='*80}")
-    print(f"Question 6: Partitioned vs Non-Partitioned Table Comparison")
-    print(f"{'='*80}")
-
     query6_non_partitioned = f"""
     SELECT DISTINCT VendorID
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`
+    FROM {materialized}
     WHERE DATE(tpep_dropoff_datetime) BETWEEN '2024-03-01' AND '2024-03-15'
     """
 
     query6_partitioned = f"""
     SELECT DISTINCT VendorID
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_partitioned_clustered`
+    FROM `{table5}`
     WHERE DATE(tpep_dropoff_datetime) BETWEEN '2024-03-01' AND '2024-03-15'
     """
 
-    job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
-
-    # Non-partitioned
-    dry_run_non_part = client.query(query6_non_partitioned, job_config=job_config)
-    non_part_bytes = dry_run_non_part.total_bytes_processed
-    non_part_mb = non_part_bytes / (1024 * 1024)
-
-    # Partitioned
-    dry_run_part = client.query(query6_partitioned, job_config=job_config)
-    part_bytes = dry_run_part.total_bytes_processed
-    part_mb = part_bytes / (1024 * 1024)
-
-    print(f"Non-partitioned table: {non_part_mb:.2f} MB ({non_part_bytes:,} bytes)")
-    print(f"Partitioned table: {part_mb:.2f} MB ({part_bytes:,} bytes)")
-
     # Question 9: COUNT(*) 예상 바이트
     query9 = f"""
     SELECT COUNT(*)
-    FROM `{PROJECT_ID}.{DATASET_ID}.yellow_taxi_materialized`
+    FROM {materialized}
     """
-    run_query_with_stats(9, "COUNT(*) from materialized table", query9)
+
+    # 모든 dry run / 쿼리를 동시에 제출하고, 결과는 문제 순서대로 출력
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        q5 = executor.submit(timed, create_or_replace_table, table5, query5)
+        q1 = executor.submit(run_query_with_stats, query1)
+        q2 = [
+            ("External Table", executor.submit(timed, estimate_bytes, query2_external)),
+            ("Materialized Table", executor.submit(timed, estimate_bytes, query2_materialized)),
+        ]
+        q4 = executor.submit(run_query_with_stats, query4)
+        q6 = [
+            ("Non-partitioned table", executor.submit(timed, estimate_bytes, query6_non_partitioned)),
+            # 파티션 테이블은 Question 5가 끝난 뒤에
+            ("Partitioned table", executor.submit(after, q5, timed, estimate_bytes, query6_partitioned)),
+        ]
+        q9 = executor.submit(run_query_with_stats, query9)
+
+        print_query_stats(1, "Total record count for 2024 Yellow Taxi Data", q1)
+
+        print_header("Question 2: Estimated bytes - External Table vs Materialized Table")
+        print_estimates(q2)
+
+        print_query_stats(4, "Records with fare_amount = 0", q4)
+
+        print_header("Question 5: Creating Partitioned and Clustered Table")
+        try:
+            created, seconds = q5.result()
+            if created:
+                print(f"✓ Partitioned and clustered table created [{seconds:.2f} s]")
+            else:
+                print("✓ Partitioned and clustered table is up to date, skipping CREATE OR REPLACE")
+            print("  Strategy: PARTITION BY tpep_dropoff_datetime, CLUSTER BY VendorID")
+        except Exception as e:
+            print(f"Error: {e}")
+
+        print_header("Question 6: Partitioned vs Non-Partitioned Table Comparison")
+        print_estimates(q6)
+
+        print_query_stats(9, "COUNT(*) from materialized table", q9)
 
     print(f"\n{'='*80}")
-    print("All queries completed!")
+    print(f"All queries completed in {time.perf_counter() - t_start:.1f} s!")
     print(f"{'='*80}")
@@ -1,12 +1,25 @@
 """
 Fix parquet type mismatches by reading with pyarrow, casting columns, and re-uploading to GCS.
 Then load into BigQuery as native tables.
+
+Which files need which casts comes from schema_plan.py, which reads only the
+parquet footers. Files that already match the unified schema are copied to
+<prefix>_fixed/ server side, without downloading their data.
 """
 import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pyarrow.parquet as pq
 import pyarrow as pa
 from google.cloud import storage, bigquery
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.gcs_index import blob_index
+from schema_plan import build_plan, cast_map_for, print_plan
+
 PROJECT_ID = "playground-486505"
 BUCKET_NAME = "data-engineering-zoomcamp-2026"
 DATASET_ID = "raw_nyc_tripdata"
@@ -17,36 +30,96 @@ gcs = storage.Client(project=PROJECT_ID)
 bq = bigquery.Client(project=PROJECT_ID)
 bucket = gcs.bucket(BUCKET_NAME)
 
-
-def fix_parquet_types(local_path, cast_map):
-    """Read parquet, cast specified columns to float64, write back."""
-    table = pq.read_table(local_path)
-    for col_name, target_type in cast_map.items():
-        if col_name in table.column_names:
-            idx = table.column_names.index(col_name)
-            col = table.column(idx)
-            if col.type != target_type:
-                table = table.set_column(idx, col_name, col.cast(target_type))
-    pq.write_table(table, local_path)
-
-
-def download_fix_reupload(prefix, file_list, cast_map):
-    """Download, fix types, re-upload."""
-    for f in file_list:
-        blob_name = f"week4/{prefix}/{f}"
-        fixed_blob_name = f"week4/{prefix}_fixed/{f}"
-        fixed_blob = bucket.blob(fixed_blob_name)
-
-        if fixed_blob.exists():
-            print(f"  Already fixed: {f}")
-            continue
-
-        local_path = f"/tmp/{f}"
-        print(f"  Fixing {f}...")
-        bucket.blob(blob_name).download_to_filename(local_path)
-        fix_parquet_types(local_path, cast_map)
-        fixed_blob.upload_from_filename(local_path)
-        os.remove(local_path)
+# Files fixed at the same time; each one holds about one row group in memory
+FIX_WORKERS = min(8, os.cpu_count() or 4)
+
+# Bucket of the current pool worker, created once per process
+_worker_bucket = None
+
+
+def fix_parquet_types(src_path, dst_path, cast_map):
+    """Cast the columns in cast_map while copying src_path to dst_path, one row group at a time."""
+    parquet_file = pq.ParquetFile(src_path)
+    schema = parquet_file.schema_arrow
+    target_schema = pa.schema([
+        field.with_type(cast_map[field.name]) if field.name in cast_map else field
+        for field in schema
+    ]).with_metadata(schema.metadata)
+
+    with pq.ParquetWriter(dst_path, target_schema) as writer:
+        for i in range(parquet_file.num_row_groups):
+            writer.write_table(parquet_file.read_row_group(i).cast(target_schema))
+
+
+def _init_worker():
+    """Give each pool worker its own storage client."""
+    global _worker_bucket
+    _worker_bucket = storage.Client(project=PROJECT_ID).bucket(BUCKET_NAME)
+
+
+def _fix_file(prefix, f, cast_map):
+    """Download one file, fix its types and upload it to <prefix>_fixed/; returns seconds taken."""
+    t0 = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix="fix_")
+    try:
+        src_path = os.path.join(work_dir, f)
+        dst_path = os.path.join(work_dir, f"fixed_{f}")
+        _worker_bucket.blob(f"week4/{prefix}/{f}").download_to_filename(src_path)
+        fix_parquet_types(src_path, dst_path, cast_map)
+        _worker_bucket.blob(f"week4/{prefix}_fixed/{f}").upload_from_filename(dst_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return time.perf_counter() - t0
+
+
+def plan_fixes(jobs):
+    """Schema plan for jobs, a list of (prefix, file_list), from the footers of the files in GCS."""
+    datasets = {}
+    for prefix, file_list in jobs:
+        index = blob_index(bucket, f"week4/{prefix}/")
+        missing = [f for f in file_list if f"week4/{prefix}/{f}" not in index]
+        if missing:
+            print(f"  Not in gs://{BUCKET_NAME}/week4/{prefix}/, skipping: {', '.join(missing)}")
+        datasets[prefix] = [f"gs://{BUCKET_NAME}/week4/{prefix}/{f}" for f in file_list if f not in missing]
+    return build_plan(datasets, gcs)
+
+
+def download_fix_reupload(plan, workers=FIX_WORKERS):
+    """Fix types as the schema plan says; plan is keyed by prefix (see plan_fixes).
+
+    Only files with columns to cast are downloaded, fixed and re-uploaded.
+    Conformant files are copied to <prefix>_fixed/ inside GCS. Files of
+    every prefix share one process pool, so the whole step takes about as
+    long as the slowest file (given enough workers).
+    """
+    t0 = time.perf_counter()
+    copied = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {}
+        for prefix, entry in plan.items():
+            # Which files are already fixed comes from one listing, not one call per file
+            index = blob_index(bucket, f"week4/{prefix}_fixed/")
+            for source in entry["sources"]:
+                f = os.path.basename(source)
+                fixed_blob_name = f"week4/{prefix}_fixed/{f}"
+                if fixed_blob_name in index:
+                    print(f"  Already fixed: {f}")
+                    continue
+                cast_map = cast_map_for(entry, source)
+                if not cast_map:
+                    index.add(bucket.copy_blob(bucket.blob(f"week4/{prefix}/{f}"), bucket, fixed_blob_name))
+                    copied += 1
+                    print(f"  Conformant, copied: {f}")
+                    continue
+                futures[executor.submit(_fix_file, prefix, f, cast_map)] = (f, index, fixed_blob_name)
+
+        for future in as_completed(futures):
+            f, index, fixed_blob_name = futures[future]
+            print(f"  Fixed {f} in {future.result():.1f} s")
+            index.add(bucket.blob(fixed_blob_name))
+
+    print(f"  Fixed {len(futures)} files in {time.perf_counter() - t0:.1f} s with {workers} workers, "
+          f"copied {copied} conformant files")
 
 
 def load_bq_table(table_name, gcs_prefix):
@@ -71,37 +144,16 @@ if __name__ == "__main__":
     yellow_files = [f"yellow_tripdata_{y}-{m:02d}.parquet" for y in [2019, 2020] for m in range(1, 13)]
     fhv_files = [f"fhv_tripdata_2019-{m:02d}.parquet" for m in range(1, 13)]
 
-    print("=== Fixing Green taxi ===")
-    download_fix_reupload("green", green_files, {
-        "VendorID": pa.float64(),
-        "RatecodeID": pa.float64(),
-        "PULocationID": pa.float64(),
-        "DOLocationID": pa.float64(),
-        "passenger_count": pa.float64(),
-        "payment_type": pa.float64(),
-        "trip_type": pa.float64(),
-        "ehail_fee": pa.float64(),
-        "congestion_surcharge": pa.float64(),
-    })
-
-    print("\n=== Fixing Yellow taxi ===")
-    download_fix_reupload("yellow", yellow_files, {
-        "VendorID": pa.float64(),
-        "RatecodeID": pa.float64(),
-        "PULocationID": pa.float64(),
-        "DOLocationID": pa.float64(),
-        "passenger_count": pa.float64(),
-        "payment_type": pa.float64(),
-        "airport_fee": pa.float64(),
-        "congestion_surcharge": pa.float64(),
-    })
-
-    print("\n=== Fixing FHV taxi ===")
-    download_fix_reupload("fhv", fhv_files, {
-        "PUlocationID": pa.float64(),
-        "DOlocationID": pa.float64(),
-        "SR_Flag": pa.float64(),
-    })
+    print("=== Planning casts from the parquet footers ===")
+    plan = plan_fixes([
+        ("green", green_files),
+        ("yellow", yellow_files),
+        ("fhv", fhv_files),
+    ])
+    print_plan(plan)
+
+    print("\n=== Fixing Green, Yellow and FHV taxi ===")
+    download_fix_reupload(plan)
 
     print("\n=== Loading into BigQuery ===")
     load_bq_table("ext_green_taxi", "green_fixed")
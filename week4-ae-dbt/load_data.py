@@ -3,8 +3,13 @@ Load taxi trip data into BigQuery for dbt Week 4 homework.
 Creates external tables pointing to parquet files in GCS.
 """
 import os
+import sys
 from google.cloud import storage, bigquery
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.download_cache import fetch
+from common.gcs_sync import SyncStats, sync_file
+
 # Setup
 PROJECT_ID = "playground-486505"
 BUCKET_NAME = "data-engineering-zoomcamp-2026"
@@ -29,25 +34,23 @@ FILES = {
 }
 
 
+# Bytes skipped vs uploaded, printed at the end of the run
+sync_stats = SyncStats()
+
+
 def upload_to_gcs(file_name, prefix):
-    """Download from TLC and upload to GCS."""
-    import subprocess
-    blob_name = f"week4/{prefix}/{file_name}"
-    blob = bucket.blob(blob_name)
+    """Download from TLC (through the shared download cache) and sync to GCS.
 
-    if blob.exists():
-        print(f"  Already exists: gs://{BUCKET_NAME}/{blob_name}")
-        return
+    An existing object is only kept when its CRC32C / MD5 matches the
+    downloaded file, so stale objects get replaced.
+    """
+    blob_name = f"week4/{prefix}/{file_name}"
 
     url = f"{BASE_URL}/{file_name}"
-    print(f"  Downloading {url}...")
-    local_path = f"/tmp/{file_name}"
-    subprocess.run(["curl", "-sL", "-o", local_path, url], check=True)
+    local_path = fetch(url)
 
-    print(f"  Uploading to gs://{BUCKET_NAME}/{blob_name}...")
-    blob.upload_from_filename(local_path)
-    os.remove(local_path)
-    print(f"  Done: {blob_name}")
+    # One listing of week4/ holds the remote checksums for every file
+    sync_file(bucket, local_path, blob_name, sync_stats, index_prefix="week4/")
 
 
 def create_external_table(table_name, gcs_prefix):
@@ -89,6 +92,7 @@ if __name__ == "__main__":
         print(f"\n--- Uploading {prefix} taxi data ---")
         for f in files:
             upload_to_gcs(f, prefix)
+    sync_stats.summary()
 
     # Step 2: Create external tables
     print("\n--- Creating external tables ---")
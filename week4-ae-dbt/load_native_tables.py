@@ -1,7 +1,16 @@
 """
 Load taxi data as native BigQuery tables file by file to handle type mismatches.
+
+Every file is loaded into its own staging table, so a file whose types
+differ from the others cannot break the load. Up to LOAD_CONCURRENCY load
+jobs run at the same time. The staging tables are then merged into the
+target with one query that casts every column to a common type, and
+dropped afterwards. Only numeric types are widened; any other mismatch
+stops the merge with a ValueError naming the column.
 """
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from google.cloud import bigquery
 
 PROJECT_ID = "playground-486505"
@@ -9,52 +18,124 @@ BUCKET_NAME = "data-engineering-zoomcamp-2026"
 DATASET_ID = "raw_nyc_tripdata"
 CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "week3-dw-bigquery", "gcs.json")
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_PATH
-client = bigquery.Client(project=PROJECT_ID)
-
+# Load jobs in flight at once (BigQuery queues jobs beyond the project limits)
+LOAD_CONCURRENCY = int(os.environ.get("BQ_LOAD_CONCURRENCY", "8"))
 
-def load_table_file_by_file(table_name, gcs_prefix, file_list, schema):
-    """Load parquet files one by one into a native BigQuery table."""
-    table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_name}"
+# Numeric types from narrowest to widest; two of them merge to the wider one
+NUMERIC_TYPES = ["INTEGER", "NUMERIC", "BIGNUMERIC", "FLOAT"]
+SQL_TYPES = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL"}
 
-    # Delete existing
-    client.delete_table(table_id, not_found_ok=True)
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_PATH
+client = bigquery.Client(project=PROJECT_ID)
 
-    for i, file_name in enumerate(file_list):
-        uri = f"gs://{BUCKET_NAME}/week4/{gcs_prefix}/{file_name}"
 
+def load_staging_table(uri, staging_id, schema):
+    """Load one file into its own staging table, retrying without the schema; returns seconds taken."""
+    t0 = time.perf_counter()
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        schema=schema,
+    )
+    try:
+        client.load_table_from_uri(uri, staging_id, job_config=job_config).result()
+    except Exception as e:
+        if schema is None:
+            raise
+        print(f"  FAIL: {uri} - {e}, retrying without schema")
         job_config = bigquery.LoadJobConfig(
             source_format=bigquery.SourceFormat.PARQUET,
-            write_disposition=(
-                bigquery.WriteDisposition.WRITE_TRUNCATE if i == 0
-                else bigquery.WriteDisposition.WRITE_APPEND
-            ),
-            schema=schema,
-            schema_update_options=[
-                bigquery.SchemaUpdateOption.ALLOW_FIELD_RELAXATION,
-            ],
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
         )
-
-        try:
-            load_job = client.load_table_from_uri(uri, table_id, job_config=job_config)
-            load_job.result()
-            print(f"  OK: {file_name}")
-        except Exception as e:
-            print(f"  FAIL: {file_name} - {e}")
-            # Try without schema for this file
-            job_config2 = bigquery.LoadJobConfig(
-                source_format=bigquery.SourceFormat.PARQUET,
-                write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-            )
-            try:
-                load_job2 = client.load_table_from_uri(uri, table_id, job_config=job_config2)
-                load_job2.result()
-                print(f"  OK (retry without schema): {file_name}")
-            except Exception as e2:
-                print(f"  FAIL (retry): {file_name} - {e2}")
-
+        client.load_table_from_uri(uri, staging_id, job_config=job_config).result()
+    return time.perf_counter() - t0
+
+
+def merge_type(column, a, b):
+    """Common BigQuery type of two column types; only numeric types are widened."""
+    if a == b:
+        return a
+    if a in NUMERIC_TYPES and b in NUMERIC_TYPES:
+        return max(a, b, key=NUMERIC_TYPES.index)
+    # Anything else (TIMESTAMP vs DATETIME, STRING vs INTEGER, ...) would only
+    # merge by casting to STRING, which silently loses the type
+    raise ValueError(f"Column {column}: cannot merge {a} and {b}, pass a schema for this table")
+
+
+def merged_columns(schemas):
+    """[(column, type)] covering every staging schema, in first-seen order."""
+    columns = {}
+    for schema in schemas:
+        for field in schema:
+            current = columns.get(field.name, field.field_type)
+            columns[field.name] = merge_type(field.name, current, field.field_type)
+            if columns[field.name] != current:
+                print(f"  Column {field.name}: {current} + {field.field_type} -> {columns[field.name]}")
+    return list(columns.items())
+
+
+def merge_sql(table_id, staging_tables, columns):
+    """CREATE OR REPLACE the target from all staging tables, cast to the merged column types."""
+    selects = []
+    for staging in staging_tables:
+        present = {field.name: field.field_type for field in staging.schema}
+        select_list = []
+        for name, field_type in columns:
+            sql_type = SQL_TYPES.get(field_type, field_type)
+            if name not in present:
+                select_list.append(f"CAST(NULL AS {sql_type}) AS `{name}`")
+            elif present[name] != field_type:
+                select_list.append(f"CAST(`{name}` AS {sql_type}) AS `{name}`")
+            else:
+                select_list.append(f"`{name}`")
+        selects.append(f"SELECT {', '.join(select_list)} FROM `{staging.full_table_id.replace(':', '.')}`")
+    return f"CREATE OR REPLACE TABLE `{table_id}` AS\n" + "\nUNION ALL\n".join(selects)
+
+
+def load_table_file_by_file(table_name, gcs_prefix, file_list, schema, concurrency=LOAD_CONCURRENCY):
+    """Load parquet files through per-file staging tables into a native BigQuery table."""
+    table_id = f"{PROJECT_ID}.{DATASET_ID}.{table_name}"
+    t0 = time.perf_counter()
+
+    staging_ids = {}
+    job_seconds = 0.0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {}
+            for file_name in file_list:
+                uri = f"gs://{BUCKET_NAME}/week4/{gcs_prefix}/{file_name}"
+                staging_id = f"{table_id}__stg_{os.path.splitext(file_name)[0].replace('-', '_')}"
+                futures[executor.submit(load_staging_table, uri, staging_id, schema)] = (file_name, staging_id)
+
+            for future in as_completed(futures):
+                file_name, staging_id = futures[future]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    print(f"  FAIL: {file_name} - {e}")
+                    continue
+                staging_ids[file_name] = staging_id
+                job_seconds += seconds
+                print(f"  OK: {file_name} ({seconds:.1f} s)")
+        load_seconds = time.perf_counter() - t0
+
+        if not staging_ids:
+            print(f"  Nothing loaded into {table_id}")
+            return
+
+        staging_tables = [client.get_table(staging_ids[f]) for f in file_list if f in staging_ids]
+        columns = merged_columns(table.schema for table in staging_tables)
+        client.query(merge_sql(table_id, staging_tables, columns)).result()
+    finally:
+        for staging_id in staging_ids.values():
+            client.delete_table(staging_id, not_found_ok=True)
+
+    elapsed = time.perf_counter() - t0
     table = client.get_table(table_id)
-    print(f"  Total rows: {table.num_rows}")
+    staged_rows = sum(t.num_rows for t in staging_tables)
+    print(f"  Total rows: {table.num_rows} (staged {staged_rows}) from {len(staging_ids)} of {len(file_list)} files")
+    print(f"  Elapsed {elapsed:.1f} s: loads {load_seconds:.1f} s ({job_seconds:.1f} s of job time, "
+          f"{concurrency} in flight), merge {elapsed - load_seconds:.1f} s")
 
 
 if __name__ == "__main__":
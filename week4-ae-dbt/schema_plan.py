@@ -0,0 +1,174 @@
+"""
+Plan the type fixes for the TLC parquet sets by reading only the file footers.
+
+A parquet footer (the file metadata at the end of the file) carries the full
+schema, so the schemas of all 60 files can be compared without reading any
+row data. For GCS objects and HTTP URLs only the last FOOTER_READ bytes are
+fetched with a range read, plus a second read when the footer is larger.
+
+For each dataset the schemas are unified (int64 + double -> double, null ->
+the other type, int32 + int64 -> int64, ...). The plan then lists, per file,
+exactly which columns differ from that target schema. fix_and_reload only
+rewrites the files in the plan and copies the others server side.
+
+Usage:
+    python3 schema_plan.py                       # week4 GCS prefixes
+    python3 schema_plan.py ./data gs://bucket/x  # local dirs/files, gs:// prefixes, https:// URLs
+
+The plan is also written as JSON to PLAN_PATH (SCHEMA_PLAN_PATH, default next
+to this script).
+"""
+import json
+import os
+import struct
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FOOTER_READ = 64 * 1024
+READ_WORKERS = 16
+PLAN_PATH = os.environ.get("SCHEMA_PLAN_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema_plan.json"))
+
+
+def _storage_client(client=None):
+    if client is not None:
+        return client
+    from google.cloud import storage
+    return storage.Client()
+
+
+def _read_tail(source, nbytes, client=None):
+    """Last nbytes of a local file, gs:// object or http(s) URL."""
+    if source.startswith("gs://"):
+        bucket_name, blob_name = source[len("gs://"):].split("/", 1)
+        blob = _storage_client(client).bucket(bucket_name).blob(blob_name)
+        # A negative start is a suffix range: the last bytes, without knowing the size
+        return blob.download_as_bytes(start=-nbytes)[-nbytes:]
+
+    if source.startswith(("http://", "https://")):
+        request = urllib.request.Request(source, headers={"Range": f"bytes=-{nbytes}"})
+        with urllib.request.urlopen(request, timeout=60) as response:
+            data = response.read()
+        # A server without range support sends the whole file
+        return data[-nbytes:]
+
+    with open(source, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - nbytes, 0))
+        return f.read()
+
+
+def read_footer_schema(source, client=None):
+    """Arrow schema of a parquet file, read from its footer only."""
+    tail = _read_tail(source, FOOTER_READ, client)
+    if tail[-4:] != b"PAR1":
+        raise ValueError(f"{source} is not a parquet file")
+
+    footer_size = struct.unpack("<I", tail[-8:-4])[0]
+    if footer_size + 8 > len(tail):
+        tail = _read_tail(source, footer_size + 8, client)
+
+    # The footer alone is enough for the reader as long as no data is read
+    return pq.read_schema(pa.BufferReader(tail[-(footer_size + 8):]))
+
+
+def unify(schemas):
+    """Target schema for a dataset: every column, with a type all files can be cast to."""
+    return pa.unify_schemas(list(schemas), promote_options="permissive").remove_metadata()
+
+
+def plan_dataset(schemas):
+    """(target schema, {file: {column: (file type, target type)}}) for one dataset.
+
+    Only files with at least one column that needs a cast are listed;
+    columns a file lacks altogether are left to the loader (nullable).
+    """
+    target = unify(schemas.values())
+    casts = {}
+    for source, schema in schemas.items():
+        mismatched = {
+            field.name: (str(field.type), str(target.field(field.name).type))
+            for field in schema
+            if field.type != target.field(field.name).type
+        }
+        if mismatched:
+            casts[source] = mismatched
+    return target, casts
+
+
+def read_schemas(sources, client=None, workers=READ_WORKERS):
+    """{source: schema} for many files, reading the footers concurrently."""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(sources, executor.map(lambda source: read_footer_schema(source, client), sources)))
+
+
+def build_plan(datasets, client=None):
+    """datasets: {name: [sources]} -> {name: {"schema": target schema, "casts": {...}, "sources": [...]}}."""
+    plan = {}
+    for name, sources in datasets.items():
+        if not sources:
+            plan[name] = {"schema": pa.schema([]), "casts": {}, "sources": []}
+            continue
+        target, casts = plan_dataset(read_schemas(sources, client))
+        plan[name] = {"schema": target, "casts": casts, "sources": list(sources)}
+    return plan
+
+
+def cast_map_for(plan_entry, source):
+    """cast_map (column -> arrow type) that makes one file conform to the target schema."""
+    target = plan_entry["schema"]
+    return {column: target.field(column).type for column in plan_entry["casts"].get(source, {})}
+
+
+def print_plan(plan):
+    for name, entry in plan.items():
+        print(f"\n=== {name}: {len(entry['casts'])} of {len(entry['sources'])} files need a cast ===")
+        print("Target schema:")
+        for field in entry["schema"]:
+            print(f"  {field.name:<25} {field.type}")
+        for source, columns in sorted(entry["casts"].items()):
+            changes = ", ".join(f"{column} {old} -> {new}" for column, (old, new) in columns.items())
+            print(f"  {os.path.basename(source)}: {changes}")
+
+
+def plan_to_json(plan):
+    return {
+        name: {
+            "schema": {field.name: str(field.type) for field in entry["schema"]},
+            "casts": entry["casts"],
+            "sources": entry["sources"],
+        }
+        for name, entry in plan.items()
+    }
+
+
+def _expand(arg, client=None):
+    """Parquet files under a local dir or gs:// prefix; anything else is taken as one file."""
+    if os.path.isdir(arg):
+        return sorted(os.path.join(arg, f) for f in os.listdir(arg) if f.endswith(".parquet"))
+    if arg.startswith("gs://") and not arg.endswith(".parquet"):
+        bucket_name, prefix = arg[len("gs://"):].split("/", 1)
+        return [
+            f"gs://{bucket_name}/{blob.name}"
+            for blob in _storage_client(client).list_blobs(bucket_name, prefix=prefix, fields="items(name),nextPageToken")
+            if blob.name.endswith(".parquet")
+        ]
+    return [arg]
+
+
+if __name__ == "__main__":
+    BUCKET_NAME = "data-engineering-zoomcamp-2026"
+    args = sys.argv[1:] or [f"gs://{BUCKET_NAME}/week4/{prefix}/" for prefix in ["green", "yellow", "fhv"]]
+    client = _storage_client() if any(arg.startswith("gs://") for arg in args) else None
+
+    datasets = {arg: _expand(arg, client) for arg in args}
+    plan = build_plan(datasets, client)
+    print_plan(plan)
+
+    with open(PLAN_PATH, "w") as f:
+        json.dump(plan_to_json(plan), f, indent=2)
+    print(f"\nPlan written to {PLAN_PATH}")
@@ -10,38 +10,316 @@ parameters:
 
 @bruin"""
 
-import urllib.request
+import hashlib
+import json
+import os
+import queue
+import shutil
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import duckdb
 
-BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+# repo root, for the download cache shared with the other weeks
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "..")))
+from common.download_cache import fetch
+
+BASE_URL = os.environ.get("TLC_BASE_URL", "https://d37ci6vzurychx.cloudfront.net/trip-data")
 TAXI_TYPES = ["yellow", "green"]
 MONTHS = range(1, 7)
 YEAR = 2024
 
+# Files downloaded at the same time; DuckDB writes stay on one connection
+DOWNLOAD_WORKERS = int(os.environ.get("INGEST_DOWNLOAD_WORKERS", 4))
+
+# A month of a taxi type is the rows picked up in that month, as in staging's time_interval
+PICKUP_COLUMNS = {"yellow": "tpep_pickup_datetime", "green": "lpep_pickup_datetime"}
+
+STATE_TABLE = "ingestion.ingestion_state"
+
+# Optional parquet lake (pipeline variable lake_dir): months land in
+# <lake_dir>/taxi_type=<type>/year=<yyyy>/month=<m>/ and the ingestion tables
+# become views over it. Empty keeps the rows in nyc_taxi.db.
+LAKE_DIR = json.loads(os.environ.get("BRUIN_VARS") or "{}").get("lake_dir", "")
+
+
+def download(taxi_type, month):
+    """(taxi_type, month, filename, local path, seconds) for one month."""
+    t0 = time.perf_counter()
+    filename = f"{taxi_type}_tripdata_{YEAR}-{month:02d}.parquet"
+    local_path = fetch(f"{BASE_URL}/{filename}")
+    return taxi_type, month, filename, local_path, time.perf_counter() - t0
+
+
+def file_fingerprint(path):
+    """Size plus a hash of the parquet footer, which changes with any change to the row groups."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(size - 8)
+        footer_size = struct.unpack("<I", f.read(4))[0]
+        f.seek(size - 8 - footer_size)
+        footer = f.read(footer_size)
+    return f"{size}-{hashlib.sha256(footer).hexdigest()[:16]}"
+
+
+def _relation_type(conn, table):
+    """'BASE TABLE', 'VIEW' or None for ingestion.<name>."""
+    row = conn.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_schema = 'ingestion' AND table_name = ?",
+        [table.split(".")[1]],
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _lake_month_dir(taxi_type, year, month):
+    return os.path.join(LAKE_DIR, f"taxi_type={taxi_type}", f"year={year}", f"month={month}")
+
+
+def load_state(conn):
+    """{(taxi_type, month): fingerprint} of the months still loaded where this run will look for them.
+
+    Without a lake that is a table in nyc_taxi.db; with one, a view plus
+    the month's partition directory. Switching between the two reloads
+    every month.
+    """
+    conn.execute(f"""
+        CREATE SCHEMA IF NOT EXISTS ingestion;
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            taxi_type   VARCHAR,
+            month       VARCHAR,
+            fingerprint VARCHAR,
+            row_count   BIGINT,
+            loaded_at   TIMESTAMP,
+            PRIMARY KEY (taxi_type, month)
+        );
+    """)
+    existing = {name for (name,) in conn.execute(
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = 'ingestion' AND table_type = ?",
+        ["VIEW" if LAKE_DIR else "BASE TABLE"],
+    ).fetchall()}
+    state = {}
+    for taxi_type, month, fingerprint, row_count in conn.execute(
+        f"SELECT taxi_type, month, fingerprint, row_count FROM {STATE_TABLE}"
+    ).fetchall():
+        if f"{taxi_type}_trips" not in existing:
+            continue
+        if LAKE_DIR and row_count and not os.path.isdir(_lake_month_dir(taxi_type, *(int(p) for p in month.split("-")))):
+            continue
+        state[(taxi_type, month)] = fingerprint
+    return state
+
+
+def _month_scan(taxi_type, months):
+    """One parallel scan over the files of a taxi type, keeping each file's own pickup month.
+
+    months is a list of (month, filename, local path, ...). union_by_name
+    lines up columns that appear, disappear or move between months (missing
+    ones read as NULL); source_file records the file each row came from.
+    Rows outside the file's month (bad clock data) are left out, so they
+    cannot pile up on reloads.
+    """
+    pickup = PICKUP_COLUMNS[taxi_type]
+    file_list = ", ".join(f"'{local_path}'" for _, _, local_path, *_ in months)
+    # path -> (source file, month) as a join, which is cheaper than parsing the path of every row
+    files = ", ".join(
+        f"('{local_path}', '{filename}', TIMESTAMP '{YEAR}-{month:02d}-01')"
+        for month, filename, local_path, *_ in months
+    )
+    return f"""
+        SELECT trips.* EXCLUDE (filename), files.source_file
+        FROM read_parquet([{file_list}], union_by_name = true, filename = true) AS trips
+        JOIN (VALUES {files}) AS files (path, source_file, month_start)
+          ON trips.filename = files.path
+         AND trips.{pickup} >= files.month_start
+         AND trips.{pickup} < files.month_start + INTERVAL 1 MONTH
+    """
+
+
+def _ensure_columns(conn, table, scan):
+    """Create table from the scan's schema, or add the columns new months brought."""
+    columns = conn.execute(f"DESCRIBE {scan}").fetchall()
+    existing = {name for (name,) in conn.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'ingestion' AND table_name = ?",
+        [table.split(".")[1]],
+    ).fetchall()}
+    if not existing:
+        conn.execute(f"CREATE TABLE {table} AS {scan} LIMIT 0")
+        return
+    for name, column_type, *_ in columns:
+        if name not in existing:
+            print(f"Adding column {name} {column_type} to {table}")
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN "{name}" {column_type}')
+
+
+def load_months(conn, taxi_type, months):
+    """Replace the given months of ingestion.<taxi_type>_trips with one scan in a single transaction.
+
+    months is a list of (month, filename, local path, fingerprint); returns rows loaded.
+    """
+    table = f"ingestion.{taxi_type}_trips"
+    pickup = PICKUP_COLUMNS[taxi_type]
+    scan = _month_scan(taxi_type, months)
+    month_starts = ", ".join(f"DATE '{YEAR}-{month:02d}-01'" for month, *_ in months)
+
+    t0 = time.perf_counter()
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        if _relation_type(conn, table) == "VIEW":
+            conn.execute(f"DROP VIEW {table}")
+        _ensure_columns(conn, table, scan)
+        conn.execute(f"DELETE FROM {table} WHERE date_trunc('month', {pickup}) IN ({month_starts})")
+        (row_count,), busy = _profiled(conn, f"INSERT INTO {table} BY NAME {scan}")
+
+        counts = dict(conn.execute(
+            f"SELECT source_file, count(*) FROM {table} WHERE source_file IN ({', '.join('?' for _ in months)}) GROUP BY 1",
+            [filename for _, filename, _, _ in months],
+        ).fetchall())
+        _record_months(conn, taxi_type, months, counts)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    _print_load(conn, len(months), table, row_count, t0, busy)
+    return row_count
+
+
+def load_months_to_lake(conn, taxi_type, months):
+    """Rewrite the given months' partition directories of the lake and point the view at it.
+
+    The scan is written once, partitioned by year and month, into an
+    _incoming directory; each month's directory is then swapped in whole,
+    so a rebuilt month never mixes old and new files. Returns rows written.
+    """
+    table = f"ingestion.{taxi_type}_trips"
+    pickup = PICKUP_COLUMNS[taxi_type]
+    type_dir = os.path.join(LAKE_DIR, f"taxi_type={taxi_type}")
+    incoming = os.path.join(type_dir, "_incoming")
+    shutil.rmtree(incoming, ignore_errors=True)
+    os.makedirs(type_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    (row_count,), busy = _profiled(conn, f"""
+        COPY (SELECT *, year({pickup}) AS year, month({pickup}) AS month FROM ({_month_scan(taxi_type, months)}))
+        TO '{incoming}' (FORMAT parquet, PARTITION_BY (year, month))
+    """)
+
+    counts = {}
+    if row_count:
+        counts = {month: count for month, count in conn.execute(
+            f"SELECT month, count(*) FROM read_parquet('{incoming}/year=*/month=*/*.parquet', hive_partitioning = true) GROUP BY 1"
+        ).fetchall()}
+    for month, *_ in months:
+        target = _lake_month_dir(taxi_type, YEAR, month)
+        shutil.rmtree(target, ignore_errors=True)
+        if month in counts:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(incoming, f"year={YEAR}", f"month={month}"), target)
+    shutil.rmtree(incoming, ignore_errors=True)
+
+    conn.execute("BEGIN TRANSACTION")
+    try:
+        if _relation_type(conn, table) == "BASE TABLE":
+            conn.execute(f"DROP TABLE {table}")
+        # Absolute path, so the view resolves wherever nyc_taxi.db is opened from
+        conn.execute(f"""
+            CREATE OR REPLACE VIEW {table} AS
+            SELECT * FROM read_parquet(
+                '{os.path.abspath(type_dir)}/year=*/month=*/*.parquet',
+                hive_partitioning = true, union_by_name = true,
+                hive_types = {{'year': INTEGER, 'month': INTEGER}}
+            )
+        """)
+        _record_months(conn, taxi_type, months, {filename: counts.get(month, 0) for month, filename, *_ in months})
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    _print_load(conn, len(months), type_dir, row_count, t0, busy)
+    return row_count
+
+
+def _record_months(conn, taxi_type, months, counts):
+    """Upsert the ingestion state of loaded months; counts is {filename: rows}."""
+    for month, filename, _, fingerprint in months:
+        conn.execute(
+            f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?, now())",
+            [taxi_type, f"{YEAR}-{month:02d}", fingerprint, counts.get(filename, 0)],
+        )
+
+
+def _profiled(conn, sql):
+    """(result row, busy fraction of DuckDB's threads) for one statement, from DuckDB's profiler.
+
+    cpu_time is the operator time summed over DuckDB's threads, so the
+    download threads running next to the load are not counted.
+    """
+    conn.execute("PRAGMA enable_profiling = 'no_output'")
+    try:
+        row = conn.execute(sql).fetchone()
+        profile = json.loads(conn.get_profiling_information(format="json"))
+    finally:
+        conn.execute("PRAGMA disable_profiling")
+    threads = conn.execute("SELECT current_setting('threads')").fetchone()[0]
+    busy = profile["cpu_time"] / (profile["latency"] * threads) if profile["latency"] else 0.0
+    return row, busy
+
+
+def _print_load(conn, month_count, target, row_count, t0, busy):
+    seconds = time.perf_counter() - t0
+    threads = conn.execute("SELECT current_setting('threads')").fetchone()[0]
+    print(f"Loaded {month_count} months into {target} ({row_count:,} rows) in {seconds:.1f} s, "
+          f"{busy:.0%} of {threads} DuckDB threads busy in the load statement (DuckDB profiler)")
+
 
 def ingest():
+    """Download months on a thread pool while this thread loads them, one scan per taxi type.
+
+    A taxi type is loaded as soon as all its months have arrived, so it
+    overlaps with the downloads of the next one. Months whose file
+    fingerprint matches the ingestion state are left out of the scan.
+    """
+    t0 = time.perf_counter()
     conn = duckdb.connect("nyc_taxi.db")
+    state = load_state(conn)
+    load = load_months_to_lake if LAKE_DIR else load_months
+    skipped = 0
+
+    # Finished downloads (futures) queue up for the single writer
+    ready = queue.Queue()
+    jobs = [(taxi_type, month) for taxi_type in TAXI_TYPES for month in MONTHS]
+    arrived = {taxi_type: [] for taxi_type in TAXI_TYPES}
+    download_seconds = write_seconds = 0.0
 
-    for taxi_type in TAXI_TYPES:
-        for month in MONTHS:
-            filename = f"{taxi_type}_tripdata_{YEAR}-{month:02d}.parquet"
-            url = f"{BASE_URL}/{filename}"
-            local_path = f"/tmp/{filename}"
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        for taxi_type, month in jobs:
+            executor.submit(download, taxi_type, month).add_done_callback(ready.put)
 
-            print(f"Downloading {filename}...")
-            urllib.request.urlretrieve(url, local_path)
+        for _ in jobs:
+            taxi_type, month, filename, local_path, seconds = ready.get().result()
+            download_seconds += seconds
 
-            conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS ingestion.{taxi_type}_trips AS
-                SELECT * FROM read_parquet('{local_path}')
-                WHERE 1=0;
+            fingerprint = file_fingerprint(local_path)
+            if state.get((taxi_type, f"{YEAR}-{month:02d}")) == fingerprint:
+                print(f"Unchanged, skipping {filename}")
+                skipped += 1
+                fingerprint = None
+            arrived[taxi_type].append((month, filename, local_path, fingerprint))
+            if len(arrived[taxi_type]) < len(MONTHS):
+                continue
 
-                INSERT INTO ingestion.{taxi_type}_trips
-                SELECT * FROM read_parquet('{local_path}');
-            """)
-            print(f"Loaded {filename} into ingestion.{taxi_type}_trips")
+            changed = sorted(m for m in arrived[taxi_type] if m[3] is not None)
+            if changed:
+                t_write = time.perf_counter()
+                load(conn, taxi_type, changed)
+                write_seconds += time.perf_counter() - t_write
 
     conn.close()
+    print(f"Ingested {len(jobs) - skipped} files ({skipped} unchanged) in {time.perf_counter() - t0:.1f} s "
+          f"(downloads {download_seconds:.1f} s over {DOWNLOAD_WORKERS} workers, DuckDB writes {write_seconds:.1f} s)")
 
 
 ingest()
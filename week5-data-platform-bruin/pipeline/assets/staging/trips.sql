@@ -58,6 +58,11 @@ SELECT
     total_amount
 FROM ingestion.yellow_trips
 WHERE tpep_pickup_datetime BETWEEN '{{ start_date }}' AND '{{ end_date }}'
+{%- if var.lake_dir %}
+  -- parquet lake: skip partitions outside the interval (plain year/month comparisons prune through the view)
+  AND (year > year(DATE '{{ start_date }}') OR (year = year(DATE '{{ start_date }}') AND month >= month(DATE '{{ start_date }}')))
+  AND (year < year(DATE '{{ end_date }}') OR (year = year(DATE '{{ end_date }}') AND month <= month(DATE '{{ end_date }}')))
+{%- endif %}
 
 UNION ALL
 
@@ -72,3 +77,7 @@ SELECT
     total_amount
 FROM ingestion.green_trips
 WHERE lpep_pickup_datetime BETWEEN '{{ start_date }}' AND '{{ end_date }}'
+{%- if var.lake_dir %}
+  AND (year > year(DATE '{{ start_date }}') OR (year = year(DATE '{{ start_date }}') AND month >= month(DATE '{{ start_date }}')))
+  AND (year < year(DATE '{{ end_date }}') OR (year = year(DATE '{{ end_date }}') AND month <= month(DATE '{{ end_date }}')))
+{%- endif %}
@@ -11,6 +11,9 @@ import sys, os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from models import GreenRide, green_ride_from_row
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', '..', '..'))
+from common.download_cache import fetch
+
 
 def json_serializer(data):
     return json.dumps(data).encode('utf-8')
@@ -24,7 +27,7 @@ def main():
         'passenger_count', 'trip_distance',
         'tip_amount', 'total_amount',
     ]
-    df = pd.read_parquet(url, columns=columns)
+    df = pd.read_parquet(fetch(url), columns=columns)
     print(f"Total rows: {len(df)}")
 
     server = 'localhost:9092'